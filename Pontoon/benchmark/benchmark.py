@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the Pontoon scripts against synthetic data.
+
+Generates a locale tree of FTL files and a set of TBX glossaries, then times the
+main entry points of fluent-migrate.py, check_string.py and tbx_merge.py and
+reports their peak memory. Everything runs offline.
+
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from xml.sax.saxutils import escape
+
+SCRIPTS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+REFERENCE_LOCALE = "en-US"
+WORDS = [
+    "account", "bookmark", "browser", "download", "extension", "Firefox",
+    "history", "Mozilla", "password", "privacy", "private", "search",
+    "settings", "sync", "tab", "window",
+]
+
+
+def load_script(relative_path):
+    """Imports a script by path, script names aren't always valid module names."""
+    name = os.path.splitext(os.path.basename(relative_path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(SCRIPTS_PATH, relative_path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def locale_codes(count):
+    return [f"x{index:03d}" for index in range(count)]
+
+
+def sentence(rng, locale, length=6):
+    return " ".join(rng.choice(WORDS) for _ in range(length)) + f" {locale}"
+
+
+def generate_locale_tree(path, locales, files, entities, commented, seed=0):
+    """
+    Writes a reference locale and `locales` localized copies of `files` FTL files with `entities` messages each.
+    A `commented` share of reference messages has a comment, localized files miss about 10% of messages.
+    Returns the list of FTL filenames.
+    """
+    rng = random.Random(seed)
+    filenames = [f"file{index}.ftl" for index in range(files)]
+    for locale in [REFERENCE_LOCALE] + locales:
+        for filename in filenames:
+            os.makedirs(os.path.join(path, locale), exist_ok=True)
+            lines = ["# This Source Code Form is subject to the terms of the Mozilla Public", ""]
+            for index in range(entities):
+                if locale == REFERENCE_LOCALE:
+                    if rng.random() < commented:
+                        lines.append(f"# Comment for message-{index}")
+                elif rng.random() < 0.1:
+                    continue
+                lines.append(f"message-{index} = {sentence(rng, locale)}")
+                if index % 4 == 0:
+                    lines.append(f"    .title = {sentence(rng, locale, 3)}")
+                lines.append("")
+            with open(os.path.join(path, locale, filename), "w") as f:
+                f.write("\n".join(lines))
+    return filenames
+
+
+TBX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<martif type="TBX" xml:lang="en-US">
+    <martifHeader>
+        <fileDesc>
+            <titleStmt>
+                <title>Mozilla Terms</title>
+            </titleStmt>
+            <sourceDesc>
+                <p>from a Mozilla termbase</p>
+            </sourceDesc>
+        </fileDesc>
+        <encodingDesc>
+            <p type="XCSURI">TBXXCSV02.xcs</p>
+        </encodingDesc>
+    </martifHeader>
+    <text>
+        <body>
+"""
+TBX_FOOTER = """        </body>
+    </text>
+</martif>
+"""
+
+
+def generate_glossaries(path, locales, terms, seed=0):
+    """
+    Writes one Pontoon TBX export per locale with `terms` terms, and a Smartling export
+    matching half of the terms. Returns the paths of the Pontoon exports and of the Smartling export.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    entries = [
+        (f"term {index}", sentence(rng, "definition") if index % 5 else None)
+        for index in range(terms)
+    ]
+
+    export_paths = []
+    for locale in locales:
+        lines = [TBX_HEADER]
+        for index, (term, definition) in enumerate(entries):
+            lines.append(f'            <termEntry id="c{index}">\n')
+            lines.append('                <langSet xml:lang="en-US">\n')
+            lines.append(f"                    <ntig><termGrp><term>{escape(term)}</term>"
+                         '<termNote type="partOfSpeech">noun</termNote></termGrp></ntig>\n')
+            if definition:
+                lines.append(f'                    <descripGrp><descrip type="definition">{escape(definition)}</descrip></descripGrp>\n')
+            lines.append("                </langSet>\n")
+            lines.append(f'                <langSet xml:lang="{locale}">\n')
+            lines.append(f"                    <ntig><termGrp><term>{escape(term)} {locale}</term></termGrp></ntig>\n")
+            lines.append("                </langSet>\n")
+            lines.append("            </termEntry>\n")
+        lines.append(TBX_FOOTER)
+        export_path = os.path.join(path, f"{locale}_pontoon.tbx")
+        with open(export_path, "w") as f:
+            f.write("".join(lines))
+        export_paths.append(export_path)
+
+    lines = [TBX_HEADER]
+    for index, (term, definition) in enumerate(entries[::2]):
+        lines.append(f'            <termEntry id="smartling-{index}">\n')
+        if definition:
+            lines.append(f'                <descrip type="definition">{escape(definition)}</descrip>\n')
+        lines.append(f'                <langSet xml:lang="en-US"><tig><term>{escape(term)}</term></tig></langSet>\n')
+        lines.append("            </termEntry>\n")
+    lines.append(TBX_FOOTER)
+    smartling_path = os.path.join(path, "smartling.tbx")
+    with open(smartling_path, "w") as f:
+        f.write("".join(lines))
+
+    return export_paths, smartling_path
+
+
+def measure(setup, run, repeat):
+    """
+    Times run(setup()) `repeat` times, then runs it once more under tracemalloc.
+    Returns wall times and the peak memory allocated by run, setup isn't measured.
+    """
+    timings = []
+    for _ in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+
+    state = setup()
+    tracemalloc.start()
+    run(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return timings, peak
+
+
+def benchmarks(data_path, locales, filenames, glossaries, smartling_path, entities):
+    """Returns (name, items, setup, run) for each benchmark, items is the amount of work run() does."""
+    fluent_migrate = load_script("fluent-migrate/fluent-migrate.py")
+    check_string = load_script("check_string/check_string.py")
+    tbx_merge = load_script("tbx_merge/tbx_merge.py")
+    locale_path = os.path.join(data_path, "locales")
+    migrate_path = os.path.join(data_path, "migrate")
+
+    def parse_references():
+        """
+        Parses reference files, and copies the generated tree to a scratch folder: migrate_files
+        writes into the tree, later runs and benchmarks must start from the generated files.
+        """
+        references = {}
+        for filename in filenames:
+            parser = fluent_migrate.getParser(filename)
+            parser.readFile(os.path.join(locale_path, REFERENCE_LOCALE, filename))
+            references[filename] = list(parser.walk())
+        if os.path.exists(migrate_path):
+            shutil.rmtree(migrate_path)
+        shutil.copytree(locale_path, migrate_path)
+        return references
+
+    def migrate(references):
+        for filename, reference in references.items():
+            for locale in locales:
+                fluent_migrate.migrate_files(
+                    reference, filename, filename, migrate_path, locale, set(), False
+                )
+
+    tasks = [(locale, filename) for locale in locales for filename in filenames]
+    string_ids = {f"message-{index}" for index in range(0, entities, 10)}
+
+    def scan(_):
+        scan_file = partial(check_string.scan_file, locale_path, string_ids=string_ids)
+        for _ in check_string.run_tasks(scan_file, tasks, 1):
+            pass
+
+    def combine(combiner):
+        combiner.combine()
+
+    def merged_glossary():
+        merged_tree = tbx_merge.XMLCombiner(glossaries).combine()
+        return merged_tree, tbx_merge.extract_smartling_id_term(smartling_path)
+
+    def replace_ids(state):
+        tbx_merge.replace_pontoon_ids(*state)
+
+    return [
+        ("fluent-migrate migrate_files", len(tasks), parse_references, migrate),
+        ("check_string scan", len(tasks), lambda: None, scan),
+        ("tbx_merge XMLCombiner.combine", len(glossaries), partial(tbx_merge.XMLCombiner, glossaries), combine),
+        ("tbx_merge replace_pontoon_ids", len(glossaries), merged_glossary, replace_ids),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--locales",
+        type=int,
+        default=20,
+        dest="locale_count",
+        help="Number of locales in the generated locale tree",
+    )
+    parser.add_argument(
+        "--files",
+        type=int,
+        default=5,
+        dest="file_count",
+        help="Number of FTL files per locale",
+    )
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=500,
+        dest="entity_count",
+        help="Number of messages per FTL file",
+    )
+    parser.add_argument(
+        "--commented",
+        type=float,
+        default=0.2,
+        dest="commented_share",
+        help="Share of reference messages with a comment, between 0 and 1",
+    )
+    parser.add_argument(
+        "--terms",
+        type=int,
+        default=500,
+        dest="term_count",
+        help="Number of terms per TBX glossary",
+    )
+    parser.add_argument(
+        "--glossary-locales",
+        type=int,
+        default=20,
+        dest="glossary_locale_count",
+        help="Number of locale TBX glossaries to merge",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        dest="repeat",
+        help="Number of timed runs per benchmark",
+    )
+    parser.add_argument(
+        "--only",
+        nargs="*",
+        dest="only",
+        help="Only run benchmarks whose name contains one of these strings",
+    )
+    parser.add_argument(
+        "--data",
+        dest="data_path",
+        help="Generate data in this folder and keep it, instead of a temporary folder",
+    )
+    parser.add_argument(
+        "--json",
+        dest="json_output",
+        help="Also store results as JSON in this file",
+    )
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1.")
+    if not 0 <= args.commented_share <= 1:
+        parser.error("--commented must be between 0 and 1.")
+
+    data_path = args.data_path or tempfile.mkdtemp(prefix="pontoon-benchmark-")
+    try:
+        locales = locale_codes(args.locale_count)
+        filenames = generate_locale_tree(
+            os.path.join(data_path, "locales"),
+            locales,
+            args.file_count,
+            args.entity_count,
+            args.commented_share,
+        )
+        glossaries, smartling_path = generate_glossaries(
+            os.path.join(data_path, "glossaries"),
+            locale_codes(args.glossary_locale_count),
+            args.term_count,
+        )
+
+        results = []
+        print(f"{'Benchmark':<32} {'Items':>7} {'Best (s)':>10} {'Mean (s)':>10} {'Items/s':>10} {'Peak (MiB)':>11}")
+        for name, items, setup, run in benchmarks(
+            data_path, locales, filenames, glossaries, smartling_path, args.entity_count
+        ):
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            timings, peak = measure(setup, run, args.repeat)
+            best = min(timings)
+            mean = sum(timings) / len(timings)
+            results.append(
+                {
+                    "name": name,
+                    "items": items,
+                    "timings": timings,
+                    "best": best,
+                    "mean": mean,
+                    "throughput": items / best if best else None,
+                    "peak_memory": peak,
+                }
+            )
+            print(f"{name:<32} {items:>7} {best:>10.3f} {mean:>10.3f} {items / best if best else 0:>10.1f} {peak / 2**20:>11.1f}")
+            sys.stdout.flush()
+    finally:
+        if not args.data_path:
+            shutil.rmtree(data_path)
+
+    if args.json_output:
+        parameters = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("data_path", "json_output", "only")
+        }
+        with open(args.json_output, "w") as f:
+            json.dump({"parameters": parameters, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
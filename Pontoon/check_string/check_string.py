@@ -1,11 +1,276 @@
 #!/usr/bin/env python3
 import argparse
+import json
 import os
+import re
+import sqlite3
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from glob import glob
 from compare_locales.parser import getParser
 from compare_locales.serializer import serialize
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiler import add_profile_arguments, profiler
+
+
+INDEX_FILENAME = ".check_string_index.sqlite"
+# Bump when the index schema changes, existing indexes are then rebuilt
+INDEX_VERSION = 2
+GRAM_LENGTH = 3
+
+
+def read_file(base_folder, locale, filename):
+    '''Returns (id, value) pairs for all strings in a single locale file, None if the file doesn't exist'''
+    target_file_path = os.path.join(base_folder, locale, filename)
+    target_parser = getParser(target_file_path)
+    try:
+        with profiler.phase("read file", os.path.join(locale, filename)):
+            target_parser.readFile(target_file_path)
+    except FileNotFoundError:
+        return None
+    with profiler.phase("walk", os.path.join(locale, filename)):
+        return [
+            (f"{entity}", entity.raw_val)
+            for entity in target_parser.walk(only_localizable=True)
+        ]
+
+
+def scan_file(base_folder, locale, filename, string_ids):
+    '''Returns (id, value) pairs for the string IDs found in a single locale file'''
+    entities = read_file(base_folder, locale, filename) or []
+    return [
+        (string_id, raw_val)
+        for string_id, raw_val in entities
+        if string_id in string_ids
+    ]
+
+
+def run_tasks(function, tasks, jobs):
+    '''Runs function(locale, filename) for each task, yields results in task order as they complete'''
+    function = profiler.traced(function)
+    task_locales = [locale for locale, _ in tasks]
+    task_filenames = [filename for _, filename in tasks]
+    if jobs == 1 or len(tasks) < 2:
+        yield from profiler.collect(map(function, task_locales, task_filenames))
+        return
+
+    # Each (locale, file) pair is parsed independently, map() keeps results in task order
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from profiler.collect(
+            executor.map(
+                function,
+                task_locales,
+                task_filenames,
+                chunksize=max(1, len(tasks) // (jobs * 4)),
+            )
+        )
+
+
+def open_index(base_folder, rebuild=False):
+    '''Opens the string index stored in the locale folder, creating it if needed'''
+    index_path = os.path.join(base_folder, INDEX_FILENAME)
+    if rebuild and os.path.exists(index_path):
+        os.remove(index_path)
+
+    connection = sqlite3.connect(index_path)
+    if connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+        connection.executescript(
+            f"""
+            DROP TABLE IF EXISTS grams;
+            DROP TABLE IF EXISTS strings;
+            DROP TABLE IF EXISTS files;
+            PRAGMA user_version = {INDEX_VERSION};
+            """
+        )
+    connection.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            locale TEXT NOT NULL,
+            file TEXT NOT NULL,
+            mtime INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (locale, file)
+        );
+        CREATE TABLE IF NOT EXISTS strings (
+            locale TEXT NOT NULL,
+            file TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            value TEXT
+        );
+        CREATE INDEX IF NOT EXISTS strings_id ON strings (id);
+        CREATE INDEX IF NOT EXISTS strings_file ON strings (locale, file);
+        CREATE TABLE IF NOT EXISTS grams (
+            gram TEXT NOT NULL,
+            string INTEGER NOT NULL,
+            PRIMARY KEY (gram, string)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS grams_string ON grams (string);
+        """
+    )
+    return connection
+
+
+def value_grams(value):
+    '''Returns the set of case-insensitive n-grams in a string value'''
+    value = value.casefold()
+    return {value[i : i + GRAM_LENGTH] for i in range(len(value) - GRAM_LENGTH + 1)}
+
+
+def update_index(connection, base_folder, tasks, jobs):
+    '''Re-parses the files of tasks that changed on disk since they were indexed'''
+    indexed = {
+        (locale, filename): (mtime, size)
+        for locale, filename, mtime, size in connection.execute(
+            "SELECT locale, file, mtime, size FROM files"
+        )
+    }
+    stale = []
+    removed = []
+    with profiler.phase("check index"):
+        for locale, filename in tasks:
+            try:
+                stat = os.stat(os.path.join(base_folder, locale, filename))
+            except FileNotFoundError:
+                if (locale, filename) in indexed:
+                    removed.append((locale, filename))
+                continue
+            if indexed.get((locale, filename)) != (stat.st_mtime_ns, stat.st_size):
+                stale.append((locale, filename, stat.st_mtime_ns, stat.st_size))
+
+    if not stale and not removed:
+        return
+
+    results = run_tasks(
+        partial(read_file, base_folder),
+        [(locale, filename) for locale, filename, _, _ in stale],
+        jobs,
+    )
+    with connection:
+        for locale, filename in removed + [(locale, filename) for locale, filename, _, _ in stale]:
+            connection.execute(
+                """
+                DELETE FROM grams WHERE string IN (
+                    SELECT rowid FROM strings WHERE locale = ? AND file = ?
+                )
+                """,
+                (locale, filename),
+            )
+            connection.execute(
+                "DELETE FROM strings WHERE locale = ? AND file = ?", (locale, filename)
+            )
+            connection.execute(
+                "DELETE FROM files WHERE locale = ? AND file = ?", (locale, filename)
+            )
+        for (locale, filename, mtime, size), entities in zip(stale, results):
+            if entities is None:
+                # Removed between stat() and parsing
+                continue
+            connection.execute(
+                "INSERT INTO files VALUES (?, ?, ?, ?)", (locale, filename, mtime, size)
+            )
+            for position, (string_id, raw_val) in enumerate(entities):
+                rowid = connection.execute(
+                    "INSERT INTO strings VALUES (?, ?, ?, ?, ?)",
+                    (locale, filename, position, string_id, raw_val),
+                ).lastrowid
+                if raw_val:
+                    connection.executemany(
+                        "INSERT INTO grams VALUES (?, ?)",
+                        [(gram, rowid) for gram in value_grams(raw_val)],
+                    )
+
+
+def query_index(connection, tasks, string_ids):
+    '''Yields (id, value) pairs for the string IDs found in each task, in task order'''
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS query_ids (id TEXT PRIMARY KEY)")
+    connection.execute("DELETE FROM query_ids")
+    connection.executemany(
+        "INSERT OR IGNORE INTO query_ids VALUES (?)", [(i,) for i in string_ids]
+    )
+    for locale, filename in tasks:
+        yield connection.execute(
+            """
+            SELECT strings.id, value FROM strings
+            JOIN query_ids ON strings.id = query_ids.id
+            WHERE locale = ? AND file = ?
+            ORDER BY position
+            """,
+            (locale, filename),
+        ).fetchall()
+
+
+def search_index(connection, tasks, text, whole_word=False):
+    '''Yields (id, value) pairs for strings whose value contains text (case-insensitive), in task order'''
+    query = text.casefold()
+    pattern = re.compile(rf"(?<!\w){re.escape(query)}(?!\w)")
+
+    def matches_query(value):
+        if whole_word:
+            return pattern.search(value.casefold()) is not None
+        return query in value.casefold()
+
+    grams = value_grams(query)
+    if grams:
+        # Only strings containing all n-grams of the query can match
+        placeholders = ", ".join("?" * len(grams))
+        rows = connection.execute(
+            f"""
+            SELECT locale, file, id, value FROM strings WHERE rowid IN (
+                SELECT string FROM grams WHERE gram IN ({placeholders})
+                GROUP BY string HAVING COUNT(*) = ?
+            )
+            ORDER BY locale, file, position
+            """,
+            (*grams, len(grams)),
+        )
+    else:
+        # Query is shorter than an n-gram, check all indexed values
+        rows = connection.execute(
+            """
+            SELECT locale, file, id, value FROM strings WHERE value IS NOT NULL
+            ORDER BY locale, file, position
+            """
+        )
+
+    matches = {}
+    for locale, filename, string_id, raw_val in rows:
+        if matches_query(raw_val):
+            matches.setdefault((locale, filename), []).append((string_id, raw_val))
+    for task in tasks:
+        yield matches.get(task, [])
+
+
+def read_ids(path):
+    '''Reads string IDs from a file with one ID per line'''
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def print_text(tasks, results):
+    '''Prints matches grouped by locale, printing each locale as soon as its files are processed'''
+    current_locale = None
+    for (locale, filename), targets in zip(tasks, results):
+        for string_id, raw_val in targets:
+            if locale != current_locale:
+                print(locale)
+                current_locale = locale
+            print(f"{filename}")
+            print(f"{string_id} = {raw_val}")
+            print("")
+
+
+def print_jsonl(tasks, results):
+    '''Prints one JSON record per match as soon as each file is processed'''
+    for (locale, filename), targets in zip(tasks, results):
+        for string_id, raw_val in targets:
+            record = {"locale": locale, "file": filename, "id": string_id, "value": raw_val}
+            print(json.dumps(record, ensure_ascii=False))
+        if targets:
+            sys.stdout.flush()
+
 
 def main():
     '''Checks if a string ID exists in a file for all locales'''
@@ -27,45 +292,103 @@ def main():
     arguments.add_argument(
         "--string",
         nargs="*",
-        required=True,
+        default=[],
         dest="string_ids",
         help="String ids to find",
     )
+    arguments.add_argument(
+        "--ids-from",
+        dest="ids_file",
+        help="Path to a file with string ids to find, one per line",
+    )
+    arguments.add_argument(
+        "--search",
+        dest="search_text",
+        help="Find strings whose translation contains this text (case-insensitive) instead of looking up IDs. Implies --index.",
+    )
+    arguments.add_argument(
+        "--term",
+        action="store_true",
+        dest="whole_word",
+        help="With --search, only match the text as a whole word or phrase",
+    )
+    arguments.add_argument(
+        "--format",
+        default="text",
+        choices=["text", "jsonl"],
+        dest="output_format",
+        help="Output format. jsonl prints one record (locale, file, id, value) per match.",
+    )
+    arguments.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        dest="jobs",
+        help="Number of processes used to scan locales (default: number of CPUs)",
+    )
+    arguments.add_argument(
+        "--index",
+        action="store_true",
+        dest="use_index",
+        help=f"Look up strings in an index stored as {INDEX_FILENAME} in --dir. Only files changed since the last lookup are parsed again.",
+    )
+    arguments.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        dest="rebuild_index",
+        help="Discard the existing index and parse all files again. Implies --index.",
+    )
+    add_profile_arguments(arguments)
 
     args = arguments.parse_args()
+    if args.jobs < 1:
+        arguments.error("--jobs must be at least 1.")
+    profiler.start(args)
+    string_ids = set(args.string_ids)
+    if args.ids_file:
+        string_ids.update(read_ids(args.ids_file))
+    if args.search_text is not None and string_ids:
+        arguments.error("--search can't be combined with --string or --ids-from.")
+    if args.search_text is None and not string_ids:
+        arguments.error("--string, --ids-from or --search is required.")
+    if args.whole_word and args.search_text is None:
+        arguments.error("--term requires --search.")
 
     # Get a list of files to update (absolute paths)
     base_folder = os.path.realpath(args.base_folder)
-    locales = [
-    d
-    for d in os.listdir(base_folder)
-    if os.path.isdir(os.path.join(base_folder, d)) and not d.startswith(".")
-        ]
-    output = {}
-    for locale in locales:
-        output[locale] = []
-        for filename in args.filenames:
-            target_file_path = os.path.join(base_folder, locale, filename)
-            target_parser = getParser(target_file_path)
-            try:
-                target_parser.readFile(target_file_path)
-            except FileNotFoundError:
-                continue
-            targets = [
-                entity
-                for entity in list(target_parser.walk(only_localizable=True))
-                if f"{entity}" in args.string_ids
-            ]
-            for target in targets:
-                output[locale].append(f"{filename}")
-                output[locale].append(f"{target} = {target.raw_val}")
-                output[locale].append("")
-        
-    for key, value in sorted(output.items()):
-        if value:
-            print(key)
-            for item in value:
-                print(item)
+    with profiler.phase("list locales"):
+        locales = sorted(
+            d
+            for d in os.listdir(base_folder)
+            if os.path.isdir(os.path.join(base_folder, d)) and not d.startswith(".")
+        )
+    tasks = [(locale, filename) for locale in locales for filename in args.filenames]
+
+    connection = None
+    if args.use_index or args.rebuild_index or args.search_text is not None:
+        with profiler.phase("open index"):
+            connection = open_index(base_folder, rebuild=args.rebuild_index)
+        with profiler.phase("update index"):
+            update_index(connection, base_folder, tasks, args.jobs)
+        if args.search_text is not None:
+            results = search_index(connection, tasks, args.search_text, args.whole_word)
+        else:
+            results = query_index(connection, tasks, string_ids)
+    else:
+        results = run_tasks(
+            partial(scan_file, base_folder, string_ids=string_ids),
+            tasks,
+            args.jobs,
+        )
+
+    # Results are generated as they are printed, lookups (and scans) are part of this phase
+    with profiler.phase("lookup and print"):
+        if args.output_format == "jsonl":
+            print_jsonl(tasks, results)
+        else:
+            print_text(tasks, results)
+    if connection:
+        connection.close()
 
 if __name__ == "__main__":
     main()
@@ -1,70 +1,209 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
+import json
 import os
 import sys
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from glob import glob
 from compare_locales.parser import getParser, FluentParser
 from compare_locales.parser.base import Entity
 from compare_locales.serializer import serialize
 
-def migrate_files(reference, filename, filename_string, base_folder, locale, omit_ids, merge, new_name=False, translations_filename_string=None, translations_path=None):    
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiler import add_profile_arguments, profiler
+
+def reattach_comments(reference, output):
+    """Returns copies of output entities with the comment of the matching reference entity attached."""
+    output_by_id = {}
+    for output_entity in output:
+        output_by_id.setdefault(f"{output_entity}", []).append(output_entity)
+
+    texts = []
+    for entity in reference:
+        if not isinstance(entity, Entity) or entity.span[0] == entity.key_span[0]:
+            continue
+        comment = entity.ctx.contents[entity.span[0] : entity.key_span[0]]
+        for output_entity in output_by_id.get(f"{entity}", []):
+            texts.append(comment + output_entity.ctx.contents[output_entity.key_span[0] : output_entity.span[1]])
+    if not texts:
+        return []
+
+    # Parse all commented entities at once, blank lines keep each comment attached to its own entity.
+    starts = []
+    offset = 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text) + 2
+    parser = FluentParser()
+    parser.readUnicode("\n\n".join(texts))
+
+    commented = [None] * len(texts)
+    for parsed in parser.walk():
+        index = bisect_right(starts, parsed.span[0]) - 1
+        if commented[index] is None:
+            commented[index] = parsed
+    return commented
+
+
+MANIFEST_FILENAME = ".fluent-migrate-manifest.json"
+# Bump when the migration output changes for the same inputs, invalidating existing manifests
+MANIFEST_VERSION = 1
+
+
+def hash_file(file_path):
+    """Returns the SHA-256 digest of a file, None if it doesn't exist."""
+    file_hash = hashlib.sha256()
+    try:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                file_hash.update(chunk)
+    except FileNotFoundError:
+        return None
+    return file_hash.digest()
+
+
+def file_matches(file_path, data):
+    """Checks if a file already contains data, comparing sizes before hashing the content."""
+    try:
+        if os.path.getsize(file_path) != len(data):
+            return False
+    except FileNotFoundError:
+        return False
+    return hash_file(file_path) == hashlib.sha256(data).digest()
+
+
+def write_file(file_path, data):
+    """Atomically replaces file_path with data, unless it already has that content. Returns True if the file changed."""
+    if file_matches(file_path, data):
+        return False
+
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    try:
+        mode = os.stat(file_path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return True
+
+
+def read_entities(file_path, omit_ids):
+    parser = getParser(file_path)
+    with profiler.phase("read file"):
+        parser.readFile(file_path)
+    with profiler.phase("walk"):
+        return [
+            entity
+            for entity in parser.walk(only_localizable=True)
+            if f"{entity}" not in omit_ids
+        ]
+
+
+def translation_file_paths(filename, filename_string, base_folder, locale, new_name=False, translations_filename_strings=None, translations_path=None):
+    """Returns the paths of the translation sources for a locale file, in order of precedence."""
     if not translations_path:
         translations_path = base_folder
     if new_name:
-        translations_filename = filename.replace(
-            filename_string, translations_filename_string
-        )
+        translations_filenames = [
+            filename.replace(filename_string, translations_filename_string)
+            for translations_filename_string in translations_filename_strings
+        ]
     else:
-        translations_filename = filename
-    target_file_path = os.path.join(translations_path, locale, translations_filename)
+        translations_filenames = [filename]
+    return [
+        os.path.join(translations_path, locale, translations_filename)
+        for translations_filename in translations_filenames
+    ]
+
+
+def migrate_files(reference, filename, filename_string, base_folder, locale, omit_ids, merge, new_name=False, translations_filename_strings=None, translations_path=None):
+    """
+    Writes the localized version of a reference file, taking translations from each translation source in turn.
+    All sources are merged in memory and the output file is serialized and written once.
+    """
     output_file_path = os.path.join(base_folder, locale, filename)
-    target_parser = getParser(target_file_path)
-    target_parser.readFile(target_file_path)
 
     output = []
-    target = [
-        entity
-        for entity in list(target_parser.walk(only_localizable=True))
-        if f"{entity}" not in omit_ids
-    ]
     if merge:
-        merged_file_parser = getParser(output_file_path)
-        merged_file_parser.readFile(output_file_path)
-        output = [
-            entity
-            for entity in list(merged_file_parser.walk(only_localizable=True))
-            if f"{entity}" not in omit_ids
-        ]
-        # Read values from existing file, preserves entities from existing file and ignores duplicates in target file.
-        output_strings = [f"{entity}" for entity in output]
-        for target_entity in target:
-            if f"{target_entity}" in output_strings:
-                continue
-            output.append(target_entity)
-    else:
-        output.extend(target)
-
-    source_comments = [entity for entity in reference if isinstance(entity, Entity) and entity.span[0] != entity.key_span[0]]
-    output[:] = [entity for entity in output if entity not in source_comments]
-    append_comments = []
-
-    for entity in source_comments:
-        for output_entity in output:
-            if f"{output_entity}" == f"{entity}":
-                text = entity.ctx.contents[entity.span[0] : entity.key_span[0]] + output_entity.ctx.contents[output_entity.key_span[0] : output_entity.span[1]]
-                parser = FluentParser()
-                parser.readUnicode(text)
-                parsed_list = list(parser.walk())
-                append_comments.append(parsed_list[0])
-    output.extend(append_comments)
-
-    output_data = serialize(filename, reference, output, {})
-
-    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-    with open(output_file_path, "wb") as f:
-        f.write(output_data)
-    
-    return output_file_path
+        output = read_entities(output_file_path, omit_ids)
+    for target_file_path in translation_file_paths(filename, filename_string, base_folder, locale, new_name, translations_filename_strings, translations_path):
+        target = read_entities(target_file_path, omit_ids)
+        if not output:
+            output.extend(target)
+            continue
+        # Keep values from the existing file and earlier sources, ignore duplicates in target file.
+        output_strings = {f"{entity}" for entity in output}
+        output.extend(
+            target_entity
+            for target_entity in target
+            if f"{target_entity}" not in output_strings
+        )
+
+    with profiler.phase("reattach comments"):
+        output.extend(reattach_comments(reference, output))
+
+    with profiler.phase("serialize"):
+        output_data = serialize(filename, reference, output, {})
+    with profiler.phase("write"):
+        changed = write_file(output_file_path, output_data)
+
+    return output_file_path, changed
+
+def migrate_locale(reference, filename, locale, migrate_filename, base_folder, omit_ids, merge, translations_filenames=None, translations_path=None):
+    """Migrates a reference file for a single locale. Returns (path, changed) for the files written and an error message, if any."""
+    files_written = []
+    try:
+        with profiler.phase("migrate", os.path.join(locale, filename)):
+            if not translations_filenames:
+                files_written.append(migrate_files(reference, filename, migrate_filename, base_folder, locale, omit_ids, merge))
+            else:
+                files_written.append(migrate_files(reference, filename, migrate_filename, base_folder, locale, omit_ids, merge, new_name=True, translations_filename_strings=translations_filenames, translations_path=translations_path))
+    except Exception as e:
+        return files_written, f"{locale}: {filename}: {e}"
+
+    return files_written, None
+
+
+def read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["files"]
+
+
+def write_manifest(manifest_path, files):
+    data = json.dumps({"version": MANIFEST_VERSION, "files": files}, indent=2, sort_keys=True)
+    write_file(manifest_path, data.encode("utf-8"))
+
+
+def inputs_digest(options, file_paths, file_hashes):
+    """Returns a digest of the migration options and the content of all input files, using file_hashes as a cache."""
+    digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode("utf-8"))
+    for file_path in file_paths:
+        if file_path not in file_hashes:
+            file_hashes[file_path] = hash_file(file_path)
+        digest.update(file_path.encode("utf-8"))
+        digest.update(file_hashes[file_path] or b"missing")
+    return digest.hexdigest()
+
 
 def main():
     arguments = argparse.ArgumentParser()
@@ -127,15 +266,37 @@ def main():
         dest="translations_path",
         help="Path to translations is defined"
     )
+    arguments.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        dest="jobs",
+        help="Number of processes used to migrate locales (default: number of CPUs)",
+    )
+    arguments.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help=f"Skip files whose reference, translations, existing output and options didn't change since the last incremental run. Content hashes are stored in {MANIFEST_FILENAME} in --path, unless --manifest is used.",
+    )
+    arguments.add_argument(
+        "--manifest",
+        dest="manifest_path",
+        help="Path to the manifest file used by --incremental",
+    )
+    add_profile_arguments(arguments)
 
     args = arguments.parse_args()
     if args.translations_filenames and args.migrate_filename is None:
         arguments.error("--target requires --source.")
     if args.merge and args.translations_filenames is None:
         arguments.error("--merge requires --target.")
-    omit_ids = []
+    if args.jobs < 1:
+        arguments.error("--jobs must be at least 1.")
+    profiler.start(args)
+    omit_ids = set()
     if args.omit_ids:
-        omit_ids = [id.lstrip() for id in args.omit_ids]
+        omit_ids = {id.lstrip() for id in args.omit_ids}
     reference_locale = args.reference_locale
 
     # Get a list of files to update (absolute paths)
@@ -143,10 +304,11 @@ def main():
     reference_path = os.path.join(base_folder, reference_locale)
 
     reference_files = []
-    for ftl_path in glob(
-        reference_path + f"/**/{args.migrate_filename}", recursive=True
-    ):
-        reference_files.append(os.path.relpath(ftl_path, reference_path))
+    with profiler.phase("list files"):
+        for ftl_path in glob(
+            reference_path + f"/**/{args.migrate_filename}", recursive=True
+        ):
+            reference_files.append(os.path.relpath(ftl_path, reference_path))
     if not reference_files:
         sys.exit(
             f"No reference file found in {os.path.join(base_folder, reference_locale)}"
@@ -156,41 +318,122 @@ def main():
     if args.locales:
         locales = args.locales
     else:
-        locales = [
-            d
-            for d in os.listdir(base_folder)
-            if os.path.isdir(os.path.join(base_folder, d)) and not d.startswith(".")
-        ]
+        with profiler.phase("list locales"):
+            locales = [
+                d
+                for d in os.listdir(base_folder)
+                if os.path.isdir(os.path.join(base_folder, d)) and not d.startswith(".")
+            ]
         locales.remove(reference_locale)
     if args.ignore_locales:
         for locale in args.ignore_locales:
             locales.remove(locale)
     locales.sort()
-    files_written = []
-    for filename in reference_files:
+    tasks = [(filename, locale) for filename in reference_files for locale in locales]
+
+    def task_file_paths(filename, locale):
+        """Returns the reference, translation sources and output paths for a task."""
+        return [
+            os.path.join(reference_path, filename),
+            *translation_file_paths(filename, args.migrate_filename, base_folder, locale, bool(args.translations_filenames), args.translations_filenames, args.translations_path),
+            os.path.join(base_folder, locale, filename),
+        ]
+
+    files_skipped = []
+    if args.incremental:
+        manifest_path = args.manifest_path or os.path.join(base_folder, MANIFEST_FILENAME)
+        manifest = read_manifest(manifest_path)
+        options = {
+            "reference": reference_locale,
+            "migrate": args.migrate_filename,
+            "translations": args.translations_filenames,
+            "translations_path": args.translations_path,
+            "omit_ids": sorted(omit_ids),
+            "merge": args.merge,
+        }
+        file_hashes = {}
+        pending_tasks = []
+        with profiler.phase("check manifest"):
+            for filename, locale in tasks:
+                digest = inputs_digest(options, task_file_paths(filename, locale), file_hashes)
+                if manifest.get(os.path.join(locale, filename)) == digest:
+                    files_skipped.append(os.path.join(base_folder, locale, filename))
+                else:
+                    pending_tasks.append((filename, locale))
+        tasks = pending_tasks
+
+    # Only parse reference files that still have work to do
+    references = {}
+    for filename in sorted({filename for filename, _ in tasks}):
         try:
             reference_file_path = os.path.join(base_folder, reference_locale, filename)
-            source_parser = getParser(reference_file_path)
-            source_parser.readFile(reference_file_path)
-            reference = list(source_parser.walk())
+            with profiler.phase("parse reference", os.path.join(reference_locale, filename)):
+                source_parser = getParser(reference_file_path)
+                source_parser.readFile(reference_file_path)
+                references[filename] = list(source_parser.walk())
         except Exception as e:
             sys.exit(f"ERROR: Can't parse reference file {filename}\n{e}")
 
-        for locale in locales:
-            if not args.translations_filenames:
-                files_written.append(migrate_files(reference, filename, args.migrate_filename, base_folder, locale, omit_ids, args.merge))
-            else:
-                for index, translation_filename in enumerate(args.translations_filenames):
-                    if index == 0:
-                        files_written.append(migrate_files(reference, filename, args.migrate_filename, base_folder, locale, omit_ids, args.merge, new_name=True, translations_filename_string=translation_filename, translations_path=args.translations_path))
-                    else:
-                        files_written.append(migrate_files(reference, filename, args.migrate_filename, base_folder, locale, omit_ids, True, new_name=True, translations_filename_string=translation_filename, translations_path=args.translations_path))
-            
-    output_files_written = list(set(files_written))
-    output_files_written.sort()
+    migrate = profiler.traced(partial(
+        migrate_locale,
+        migrate_filename=args.migrate_filename,
+        base_folder=base_folder,
+        omit_ids=omit_ids,
+        merge=args.merge,
+        translations_filenames=args.translations_filenames,
+        translations_path=args.translations_path,
+    ))
+    task_references = [references[filename] for filename, _ in tasks]
+    task_filenames = [filename for filename, _ in tasks]
+    task_locales = [locale for _, locale in tasks]
+    if args.jobs == 1:
+        results = list(profiler.collect(map(migrate, task_references, task_filenames, task_locales)))
+    else:
+        # Tasks sharing a chunk are pickled together, so each chunk carries its parsed reference only once
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(
+                profiler.collect(
+                    executor.map(
+                        migrate,
+                        task_references,
+                        task_filenames,
+                        task_locales,
+                        chunksize=max(1, len(tasks) // (args.jobs * 4)),
+                    )
+                )
+            )
+
+    files_written = []
+    errors = []
+    for written, error in results:
+        files_written.extend(written)
+        if error:
+            errors.append(error)
+
+    if args.incremental:
+        # Record the inputs as they are after this run, outputs may have been rewritten
+        file_hashes = {}
+        with profiler.phase("update manifest"):
+            for (filename, locale), (_, error) in zip(tasks, results):
+                if error:
+                    manifest.pop(os.path.join(locale, filename), None)
+                else:
+                    manifest[os.path.join(locale, filename)] = inputs_digest(options, task_file_paths(filename, locale), file_hashes)
+            write_manifest(manifest_path, manifest)
+
+    output_files_changed = sorted({path for path, changed in files_written if changed})
+    output_files_unchanged = sorted(
+        ({path for path, changed in files_written if not changed} | set(files_skipped)) - set(output_files_changed)
+    )
     print("Files written:")
-    for output_file in output_files_written:
+    for output_file in output_files_changed:
         print(output_file)
+    if output_files_unchanged:
+        print("Files unchanged:")
+        for output_file in output_files_unchanged:
+            print(output_file)
+    if errors:
+        sys.exit("ERROR: Migration failed for:\n" + "\n".join(errors))
 
 
 if __name__ == "__main__":
@@ -3,73 +3,387 @@ Retrieves a list of locales missing in Pontoon for a single project by comparing
 
 Output as CSV file with column Missing Locales.
 
+With --batch, compares several projects at once using a JSON file mapping Pontoon project
+slugs to GitHub repos, and outputs a CSV matrix of missing locales per project.
+
+With --local, locale folders are listed from a local checkout or bare clone of the repo instead
+of the GitHub API.
+
 """
 import argparse
+import base64
+import http.client
 import json
+import os
+import re
+import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote as urlquote
-from urllib.request import urlopen
+from urllib.parse import unquote, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+pontoon_url = "https://pontoon.mozilla.org"
+github_api_url = "https://api.github.com"
+ignored_folders = ["templates", "configs"]
+# Responses worth retrying, other errors are reported right away
+retry_statuses = {429, 500, 502, 503, 504}
+redirect_statuses = {301, 302, 303, 307, 308}
+max_redirects = 5
+
+cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "github_cache.json")
+
+# Each thread keeps one open connection per host
+connections = threading.local()
+
+
+def get_proxy(scheme, host):
+    """Returns the parts of the proxy URL set in the environment for scheme and host, None to connect directly."""
+    proxy = getproxies().get(scheme)
+    if not proxy or proxy_bypass(host):
+        return None
+    if "://" not in proxy:
+        proxy = f"http://{proxy}"
+    return urlsplit(proxy)
+
+
+def get_connection(scheme, host, timeout):
+    """
+    Returns the connection to host for this thread, the prefix of request targets and the headers
+    to add to requests: plain HTTP requests are sent to the proxy with the full URL, HTTPS requests
+    go through a tunnel opened by the proxy.
+    """
+    pool = connections.__dict__.setdefault("pool", {})
+    if (scheme, host) not in pool:
+        proxy = get_proxy(scheme, host)
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        if proxy is None:
+            pool[(scheme, host)] = (connection_class(host, timeout=timeout), "", {})
+        else:
+            proxy_headers = {}
+            if proxy.username:
+                credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+                proxy_headers["Proxy-Authorization"] = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+            connection = connection_class(proxy.hostname, proxy.port, timeout=timeout)
+            if scheme == "https":
+                connection.set_tunnel(host, headers=proxy_headers)
+                pool[(scheme, host)] = (connection, "", {})
+            else:
+                pool[(scheme, host)] = (connection, f"{scheme}://{host}", proxy_headers)
+    return pool[(scheme, host)]
+
+
+def http_get(url, timeout=30, retries=3, headers=None):
+    """
+    Sends a GET request, following redirects (e.g. for renamed GitHub repositories).
+    Returns the response status, headers and body.
+    """
+    headers = {"User-Agent": "missing_locales", **(headers or {})}
+    for _ in range(max_redirects + 1):
+        status, response_headers, body = send_request(url, timeout, retries, headers)
+        location = response_headers.get("Location")
+        if status not in redirect_statuses or not location:
+            return status, response_headers, body
+        redirect_url = urljoin(url, location)
+        if urlsplit(redirect_url).netloc != urlsplit(url).netloc:
+            # Don't send credentials to another host
+            headers = {k: v for k, v in headers.items() if k != "Authorization"}
+        url = redirect_url
+    raise OSError(f"Too many redirects from {url}")
+
+
+def send_request(url, timeout, retries, headers):
+    """
+    Sends a GET request over a reused connection, retrying with exponential backoff on
+    connection errors and temporary server errors.
+    """
+    parts = urlsplit(url)
+    target = parts.path or "/"
+    if parts.query:
+        target += f"?{parts.query}"
+
+    for attempt in range(retries + 1):
+        connection, prefix, proxy_headers = get_connection(parts.scheme, parts.netloc, timeout)
+        delay = 2**attempt
+        try:
+            connection.request("GET", prefix + target, headers={**headers, **proxy_headers})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            # The connection can't be reused after an error, the next attempt opens a new one
+            connection.close()
+            error = e
+        else:
+            if response.status not in retry_statuses:
+                return response.status, response.headers, body
+            error = OSError(f"HTTP {response.status} from {url}")
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = int(retry_after)
+        if attempt < retries:
+            time.sleep(delay)
+    raise error
+
+
+def get_json(url, timeout=30, retries=3):
+    status, _, body = http_get(url, timeout, retries)
+    if status != 200:
+        raise OSError(f"HTTP {status} from {url}")
+    return json.loads(body)
+
+
+def next_link(link_header):
+    """Returns the URL of the next page from a Link header, None on the last page."""
+    match = re.search(r'<([^>]+)>;\s*rel="next"', link_header or "")
+    return match.group(1) if match else None
+
+
+def get_github_page(url, timeout=30, retries=3, cache=None):
+    """
+    Retrieves a page of a GitHub API listing, revalidating the cached copy with its ETag if there is one.
+    Returns the page data and the URL of the next page.
+    """
+    headers = {"Accept": "application/vnd.github+json"}
+    if os.environ.get("GITHUB_TOKEN"):
+        headers["Authorization"] = f"Bearer {os.environ['GITHUB_TOKEN']}"
+    cached = cache.get(url) if cache is not None else None
+    if cached:
+        headers["If-None-Match"] = cached["etag"]
+
+    status, response_headers, body = http_get(url, timeout, retries, headers)
+    if status == 304 and cached:
+        return cached["data"], cached["next"]
+    if status != 200:
+        raise OSError(f"HTTP {status} from {url}")
 
+    data = json.loads(body)
+    next_url = next_link(response_headers.get("Link"))
+    if cache is not None and response_headers.get("ETag"):
+        cache[url] = {"etag": response_headers["ETag"], "data": data, "next": next_url}
+    return data, next_url
 
-def retrieve_pontoon_locales(project):
-    query = f'{{project(slug:"{project}"){{name,localizations{{locale{{code}}}}}}}}'
-    url = f"https://pontoon.mozilla.org/graphql?query={urlquote(query)}"
 
+def read_cache(path):
     try:
-        response = urlopen(url)
-        json_data = json.load(response)
-        if "errors" in json_data:
-            sys.exit(f"Project {project} not found in Pontoon.")
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
 
-        locale_list = []
-        for locale in json_data["data"]["project"]["localizations"]:
-            locale_list.append(locale["locale"]["code"])
-        locale_list.sort()
 
-        return locale_list
+def write_cache(cache, path):
+    with open(path, "w") as f:
+        json.dump(cache, f, separators=(",", ":"))
+
+
+def filter_locales(entries):
+    """Returns the sorted names of locale folders from (name, is_folder) pairs."""
+    # Ignore files, hidden folder, non-locale folders via ignore list
+    locale_list = [
+        name
+        for name, is_folder in entries
+        if is_folder and not name.startswith(".") and name not in ignored_folders
+    ]
+    locale_list.sort()
+
+    return locale_list
+
+
+def query_pontoon_locales(projects, base_url=pontoon_url, timeout=30, retries=3):
+    """
+    Retrieves the locales of all projects with a single GraphQL query.
+    Returns a dictionary with the sorted locale codes of each project, None if the project wasn't found.
+    """
+    # Each project is queried under its own alias, p0, p1...
+    fields = "".join(
+        f'p{i}:project(slug:{json.dumps(project)}){{name,localizations{{locale{{code}}}}}}'
+        for i, project in enumerate(projects)
+    )
+    url = f"{base_url}/graphql?query={urlquote(f'{{{fields}}}')}"
+    json_data = get_json(url, timeout, retries)
+    data = json_data.get("data") or {}
+
+    project_locales = {}
+    for i, project in enumerate(projects):
+        if not data.get(f"p{i}"):
+            project_locales[project] = None
+            continue
+        project_locales[project] = sorted(
+            locale["locale"]["code"] for locale in data[f"p{i}"]["localizations"]
+        )
+    return project_locales
+
+
+def retrieve_pontoon_locales(project, base_url=pontoon_url):
+    try:
+        locale_list = query_pontoon_locales([project], base_url)[project]
     except Exception as e:
         sys.exit(e)
+    if locale_list is None:
+        sys.exit(f"Project {project} not found in Pontoon.")
+
+    return locale_list
 
 
-def retrieve_github_locales(owner, repo, path):
+def fetch_github_locales(owner, repo, path, base_url=github_api_url, timeout=30, retries=3, cache=None):
     query = f"/repos/{owner}/{repo}/contents/{path}"
-    url = f"https://api.github.com{urlquote(query)}"
+    url = f"{base_url}{urlquote(query)}"
 
-    ignored_folders = ["templates", "configs"]
+    # Large listings are split in pages, follow them all
+    json_data = []
+    while url:
+        page, url = get_github_page(url, timeout, retries, cache)
+        json_data.extend(page)
 
+    return filter_locales((e["name"], e["type"] == "dir") for e in json_data)
+
+
+def retrieve_github_locales(owner, repo, path, base_url=github_api_url, cache=None):
     try:
-        response = urlopen(url)
-        json_data = json.load(response)
-
-        # Ignore files, hidden folder, non-locale folders via ignore list
-        locale_list = [
-            e["name"]
-            for e in json_data
-            if e["type"] == "dir"
-            and not e["name"].startswith(".")
-            and e["name"] not in ignored_folders
-        ]
-        locale_list.sort()
-
-        return locale_list
+        return fetch_github_locales(owner, repo, path, base_url, cache=cache)
     except Exception as e:
         sys.exit(f"GitHub error: {e}")
 
 
+def is_bare_repository(path):
+    return (
+        os.path.isfile(os.path.join(path, "HEAD"))
+        and os.path.isdir(os.path.join(path, "objects"))
+        and not os.path.exists(os.path.join(path, ".git"))
+    )
+
+
+def list_local_locales(repo_path, path=""):
+    """
+    Lists locale folders in path, from a checkout of the repo, or from the HEAD tree of a bare repo.
+    """
+    if is_bare_repository(repo_path):
+        output = subprocess.run(
+            ["git", "--git-dir", repo_path, "ls-tree", "-z", f"HEAD:{path.strip('/')}"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        # Each entry is "<mode> <type> <object>\t<name>"
+        entries = []
+        for line in output.split("\0"):
+            if line:
+                info, name = line.split("\t", 1)
+                entries.append((name, info.split()[1] == "tree"))
+        return filter_locales(entries)
+
+    with os.scandir(os.path.join(repo_path, path)) as it:
+        return filter_locales((entry.name, entry.is_dir()) for entry in it)
+
+
+def retrieve_local_locales(repo_path, path=""):
+    try:
+        return list_local_locales(repo_path, path)
+    except subprocess.CalledProcessError as e:
+        sys.exit(f"Git error: {e.stderr.strip()}")
+    except OSError as e:
+        sys.exit(f"Local repository error: {e}")
+
+
+def read_mapping(path, default_owner):
+    """
+    Reads a JSON file mapping Pontoon project slugs to GitHub repos.
+    Values are either a repository name, or an object with repo, and optional owner, path, and
+    local (path to a checkout or bare clone to list locales from, instead of GitHub).
+    """
+    with open(path) as f:
+        mapping = json.load(f)
+
+    projects = {}
+    for project, repo in mapping.items():
+        if isinstance(repo, str):
+            repo = {"repo": repo}
+        if not repo.get("repo") and not repo.get("local"):
+            sys.exit(f"No repo or local path defined for project {project}.")
+        projects[project] = (
+            repo.get("owner", default_owner),
+            repo.get("repo"),
+            repo.get("path", ""),
+            repo.get("local"),
+        )
+    return projects
+
+
+def find_missing_locales(projects, args, cache=None):
+    """
+    Compares Pontoon and GitHub locales for all projects.
+    Returns the sorted missing locales of each project, and the errors of projects that couldn't be compared.
+    """
+    try:
+        pontoon_locales = query_pontoon_locales(
+            list(projects), args.pontoon_url, args.timeout, args.retries
+        )
+    except Exception as e:
+        sys.exit(f"Pontoon error: {e}")
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            project: executor.submit(list_local_locales, local, path)
+            if local
+            else executor.submit(
+                fetch_github_locales, owner, repo, path, args.github_url, args.timeout, args.retries, cache
+            )
+            for project, (owner, repo, path, local) in projects.items()
+            if pontoon_locales[project] is not None
+        }
+
+    missing = {}
+    errors = {}
+    for project in projects:
+        if pontoon_locales[project] is None:
+            errors[project] = f"Project {project} not found in Pontoon."
+            continue
+        try:
+            github_locales = futures[project].result()
+        except subprocess.CalledProcessError as e:
+            errors[project] = f"{project}: Git error: {e.stderr.strip()}"
+            continue
+        except Exception as e:
+            errors[project] = f"{project}: {'Local repository' if projects[project][3] else 'GitHub'} error: {e}"
+            continue
+        missing[project] = sorted(set(github_locales) - set(pontoon_locales[project]))
+
+    return missing, errors
+
+
+def write_matrix(missing, path):
+    """Writes a CSV file with a row per project and a column per locale, X marking missing locales."""
+    locales = sorted({locale for project_locales in missing.values() for locale in project_locales})
+    output = [",".join(["Project"] + locales)]
+    for project, project_locales in missing.items():
+        row = [project] + ["X" if locale in project_locales else "" for locale in locales]
+        output.append(",".join(row))
+    with open(path, "w") as f:
+        f.write("\n".join(output))
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--pontoon",
-        required=True,
+        required=False,
         dest="pontoon_project",
         help="Pontoon project name",
     )
     parser.add_argument(
         "--repo",
-        required=True,
+        required=False,
         dest="github_repo",
         help="GitHub repository name",
     )
+    parser.add_argument(
+        "--batch",
+        required=False,
+        dest="batch_file",
+        help="Path to a JSON file mapping Pontoon project names to GitHub repository names, or to objects with repo, owner and path. Replaces --pontoon and --repo.",
+    )
     parser.add_argument(
         "--owner",
         required=False,
@@ -84,6 +398,19 @@ def main():
         dest="github_path",
         help="GitHub path that contains locale folders",
     )
+    parser.add_argument(
+        "--local",
+        required=False,
+        dest="local_repo",
+        help="Path to a checkout or bare clone of the repository, to list locale folders from instead of the GitHub API. Replaces --repo.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        default=True,
+        dest="use_cache",
+        help=f"Don't use the cache of GitHub listings ({os.path.basename(cache_path)}), which are otherwise only downloaded again if they changed",
+    )
     parser.add_argument(
         "--csv",
         required=False,
@@ -92,13 +419,89 @@ def main():
         dest="csv_output",
         help="Store data as output.csv",
     )
+    parser.add_argument(
+        "--json",
+        required=False,
+        action="store_true",
+        default=False,
+        dest="json_output",
+        help="With --batch, also store missing locales per project as output.json",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=8,
+        dest="jobs",
+        help="With --batch, number of GitHub repositories queried at the same time (default: 8)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=30,
+        dest="timeout",
+        help="Timeout of each request in seconds (default: 30)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        dest="retries",
+        help="Number of retries of a failed request, with exponential backoff (default: 3)",
+    )
+    parser.add_argument(
+        "--pontoon-url",
+        default=pontoon_url,
+        dest="pontoon_url",
+        help=f"Base URL of Pontoon (default: {pontoon_url})",
+    )
+    parser.add_argument(
+        "--github-url",
+        default=github_api_url,
+        dest="github_url",
+        help=f"Base URL of the GitHub API (default: {github_api_url})",
+    )
 
     args = parser.parse_args()
+    if args.batch_file and (args.pontoon_project or args.github_repo or args.local_repo):
+        parser.error("--batch can't be combined with --pontoon, --repo or --local.")
+    if not args.batch_file and not (
+        args.pontoon_project and (args.github_repo or args.local_repo)
+    ):
+        parser.error("--pontoon and --repo (or --local) are required, unless --batch is used.")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    if args.retries < 0:
+        parser.error("--retries can't be negative.")
 
-    pontoon_locales = retrieve_pontoon_locales(args.pontoon_project)
-    github_locales = retrieve_github_locales(
-        args.github_owner, args.github_repo, args.github_path
-    )
+    if args.batch_file:
+        projects = read_mapping(args.batch_file, args.github_owner)
+        cache = read_cache(cache_path) if args.use_cache else None
+        missing, errors = find_missing_locales(projects, args, cache)
+        if cache is not None:
+            write_cache(cache, cache_path)
+        for project, missing_locales in missing.items():
+            print(f"{project}: {', '.join(missing_locales)}")
+        if args.csv_output:
+            write_matrix(missing, "output.csv")
+            print("Missing locales saved to output.csv")
+        if args.json_output:
+            with open("output.json", "w") as f:
+                json.dump(missing, f, indent=2)
+            print("Missing locales saved to output.json")
+        if errors:
+            sys.exit("ERROR: Comparison failed for:\n" + "\n".join(errors.values()))
+        return
+
+    pontoon_locales = retrieve_pontoon_locales(args.pontoon_project, args.pontoon_url)
+    if args.local_repo:
+        github_locales = retrieve_local_locales(args.local_repo, args.github_path)
+    else:
+        cache = read_cache(cache_path) if args.use_cache else None
+        github_locales = retrieve_github_locales(
+            args.github_owner, args.github_repo, args.github_path, args.github_url, cache
+        )
+        if cache is not None:
+            write_cache(cache, cache_path)
 
     output = ["Missing Locales"]
     missing_locales = list(set(github_locales) - set(pontoon_locales))
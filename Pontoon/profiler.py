@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Per-phase profiling shared by the Pontoon scripts.
+
+Scripts mark the work they do with `profiler.phase(name, item)`, where item is the locale or
+file being processed (nested phases inherit the item of the enclosing phase). With --profile,
+wall time, call count and peak memory (traced with tracemalloc) of each phase are printed to
+stderr when the script exits. --profile-json writes the same data as JSON, --profile-dump writes
+cProfile statistics for the main process. Without these options, phase() returns a shared no-op
+context manager and nothing is measured.
+
+Phases recorded in worker processes are sent back with the results of functions wrapped with
+traced(), and merged with collect(). Memory is only measured in the main thread of each process.
+
+"""
+import atexit
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+disabled_phase = nullcontext()
+# Number of (phase, item) pairs listed in the summary table
+slowest_items = 10
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.pid = None
+        self.worker = False
+        self.cprofile = None
+        self.reset()
+
+    def reset(self):
+        # (phase, item): [calls, seconds, peak bytes], in the order phases are first seen
+        self.records = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # Highest traced memory of each open phase in the main thread, the first one is the whole run
+        self.peaks = [0]
+
+    def start(self, args):
+        """Starts recording if any of the profiling options is set."""
+        self.print_table = getattr(args, "profile", False)
+        self.json_path = getattr(args, "profile_json", None)
+        self.dump_path = getattr(args, "profile_dump", None)
+        if not (self.print_table or self.json_path or self.dump_path):
+            return
+
+        self.enabled = True
+        self.pid = os.getpid()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.dump_path:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        self.start_time = time.perf_counter()
+        atexit.register(self.finish)
+
+    def phase(self, name, item=None):
+        """Returns a context manager recording the time and memory spent in a phase."""
+        if not self.enabled:
+            return disabled_phase
+        return self.record_phase(name, item)
+
+    @contextmanager
+    def record_phase(self, name, item):
+        items = self.local.__dict__.setdefault("items", [])
+        if item is None and items:
+            item = items[-1]
+        items.append(item)
+        track_memory = threading.current_thread() is threading.main_thread()
+        if track_memory:
+            self.peaks[-1] = max(self.peaks[-1], tracemalloc.get_traced_memory()[1])
+            self.peaks.append(0)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            items.pop()
+            peak = None
+            if track_memory:
+                # The enclosing phase keeps the highest peak of its children
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                self.peaks[-1] = max(self.peaks[-1], peak)
+                tracemalloc.reset_peak()
+            self.add(name, item, 1, seconds, peak)
+
+    def add(self, name, item, calls, seconds, peak):
+        with self.lock:
+            record = self.records.setdefault((name, item), [0, 0.0, None])
+            record[0] += calls
+            record[1] += seconds
+            if peak is not None:
+                record[2] = peak if record[2] is None else max(record[2], peak)
+
+    def traced(self, function):
+        """Returns function, wrapped to send back the phases it records when it runs in a worker process."""
+        if not self.enabled:
+            return function
+        return partial(run_traced, self.pid, function)
+
+    def collect(self, results):
+        """Merges the phases sent back by a traced function, yields its results."""
+        if not self.enabled:
+            return results
+        return self.merge_results(results)
+
+    def merge_results(self, results):
+        for result, records in results:
+            for (name, item), record in (records or {}).items():
+                self.add(name, item, *record)
+            yield result
+
+    def phases(self):
+        """Returns the records of each phase, all items combined."""
+        phases = {}
+        for (name, _), (calls, seconds, peak) in self.records.items():
+            record = phases.setdefault(name, [0, 0.0, None])
+            record[0] += calls
+            record[1] += seconds
+            if peak is not None:
+                record[2] = peak if record[2] is None else max(record[2], peak)
+        return phases
+
+    def finish(self):
+        if os.getpid() != self.pid:
+            return
+        wall_time = time.perf_counter() - self.start_time
+        peak = max(self.peaks[0], tracemalloc.get_traced_memory()[1])
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.dump_path)
+        if self.print_table:
+            print_profile(wall_time, peak, self.phases(), self.records)
+        if self.json_path:
+            with open(self.json_path, "w") as f:
+                json.dump(profile_json(wall_time, peak, self.phases(), self.records), f, indent=2)
+
+
+def run_traced(pid, function, *args):
+    """Runs function, returns its result and the phases recorded if it ran in a worker process."""
+    if os.getpid() == pid:
+        return function(*args), None
+    if not profiler.worker:
+        # First task in this worker, forked workers start with a copy of the main process profiler
+        if profiler.cprofile:
+            profiler.cprofile.disable()
+            profiler.cprofile = None
+        profiler.enabled = True
+        profiler.worker = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    profiler.reset()
+    result = function(*args)
+    return result, profiler.records
+
+
+def format_peak(peak):
+    return "-" if peak is None else f"{peak / 1024 / 1024:.1f}"
+
+
+def print_profile(wall_time, peak, phases, records):
+    print("", file=sys.stderr)
+    print(
+        f"Profile: {wall_time:.3f} s wall time, {format_peak(peak)} MiB peak memory",
+        file=sys.stderr,
+    )
+    print(f"{'Phase':<30} {'Calls':>8} {'Time (s)':>10} {'Peak (MiB)':>11}", file=sys.stderr)
+    for name, (calls, seconds, phase_peak) in phases.items():
+        print(
+            f"{name:<30} {calls:>8} {seconds:>10.3f} {format_peak(phase_peak):>11}",
+            file=sys.stderr,
+        )
+
+    items = sorted(
+        ((key, record) for key, record in records.items() if key[1] is not None),
+        key=lambda entry: entry[1][1],
+        reverse=True,
+    )
+    if items:
+        print("", file=sys.stderr)
+        print(f"{'Slowest items':<30} {'Calls':>8} {'Time (s)':>10} {'Peak (MiB)':>11}", file=sys.stderr)
+        for (name, item), (calls, seconds, item_peak) in items[:slowest_items]:
+            print(
+                f"{name + ': ' + str(item):<30} {calls:>8} {seconds:>10.3f} {format_peak(item_peak):>11}",
+                file=sys.stderr,
+            )
+    print(
+        "Times of phases run in parallel are added up, and include the time of nested phases.",
+        file=sys.stderr,
+    )
+
+
+def profile_json(wall_time, peak, phases, records):
+    return {
+        "wall_seconds": wall_time,
+        "peak_bytes": peak,
+        "phases": [
+            {"phase": name, "calls": calls, "seconds": seconds, "peak_bytes": phase_peak}
+            for name, (calls, seconds, phase_peak) in phases.items()
+        ],
+        "items": [
+            {"phase": name, "item": item, "calls": calls, "seconds": seconds, "peak_bytes": item_peak}
+            for (name, item), (calls, seconds, item_peak) in records.items()
+            if item is not None
+        ],
+    }
+
+
+def add_profile_arguments(parser):
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        dest="profile",
+        help="Print wall time, call counts and peak memory of each phase, per locale or file, to stderr when done",
+    )
+    parser.add_argument(
+        "--profile-json",
+        dest="profile_json",
+        help="Write the profile as JSON to this path",
+    )
+    parser.add_argument(
+        "--profile-dump",
+        dest="profile_dump",
+        help="Write cProfile statistics of the main thread to this path, work done in worker processes is not included",
+    )
+
+
+profiler = Profiler()
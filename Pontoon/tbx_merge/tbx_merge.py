@@ -1,15 +1,56 @@
 import os
 import argparse
+import hashlib
+import io
+import json
+import sqlite3
+import sys
+import tempfile
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from contextlib import closing
+from itertools import groupby
 from pathlib import Path
-from xml.etree import ElementTree as et
+from requests.adapters import HTTPAdapter
 
-nsmap = {"xml": "http://www.w3.org/XML/1998/namespace"}
+try:
+    # lxml parses and serializes faster, the standard library is used if it isn't installed
+    from lxml import etree as et
 
+    # The standard library parser drops comments and processing instructions, keep results the same
+    parser_options = {"remove_comments": True, "remove_pis": True}
+except ImportError:
+    from xml.etree import ElementTree as et
 
-class hashabledict(dict):
-    def __hash__(self):
-        return hash(tuple(sorted(self.items())))
+    parser_options = {}
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from profiler import add_profile_arguments, profiler
+
+xml_lang = "{http://www.w3.org/XML/1998/namespace}lang"
+pontoon_url = "https://pontoon.mozilla.org"
+export_cache_filename = "export_cache.json"
+smartling_cache_filename = "smartling_map.json"
+merged_glossary_filename = "merged_glossary.tbx"
+merge_state_filename = "merge_state.json"
+# Bump when the merge state format changes, the glossary is then combined from scratch
+merge_state_version = 1
+
+
+def parse_xml(source):
+    if parser_options:
+        return et.parse(str(source), et.XMLParser(**parser_options))
+    return et.parse(source)
+
+
+def iterparse_xml(source, events):
+    return et.iterparse(str(source), events=events, **parser_options)
+
+
+def element_key(el):
+    """Identifies an element among its siblings by its tag and attributes."""
+    return el.tag, frozenset(el.attrib.items())
 
 
 class XMLCombiner(object):
@@ -17,16 +58,22 @@ class XMLCombiner(object):
         if len(filenames) == 0:
             raise FileNotFoundError("Invalid path, or path contains no valid files.")
 
+        self.filenames = filenames
+        # Mapping of element keys to children, for each element children were merged into
+        self.mappings = {}
         try:
-            self.roots = [et.parse(f).getroot() for f in filenames]
+            self.roots = []
+            for f in filenames:
+                with profiler.phase("parse XML", Path(f).name):
+                    self.roots.append(parse_xml(f).getroot())
         except SyntaxError:
             print("Invalid tbx file, possibly due to incorrect locale code. Check your locales file to ensure all locale codes are valid.")
-
-
+            raise
 
     def combine(self):
-        for r in self.roots[1:]:
-            self.combine_element(self.roots[0], r)
+        for f, r in zip(self.filenames[1:], self.roots[1:]):
+            with profiler.phase("combine", Path(f).name):
+                self.combine_element(self.roots[0], r)
         return et.ElementTree(self.roots[0])
 
     def combine_element(self, one, other):
@@ -35,72 +82,359 @@ class XMLCombiner(object):
         It updates either the text/attributes/children of an element if another element is found in `one`,
         or adds it from `other` if not found.
         """
-        mapping = {(el.tag, hashabledict(el.attrib)): el for el in one}
-        for el in other:
-            if len(el) == 0:
+        mapping = self.mappings.get(one)
+        if mapping is None:
+            mapping = self.mappings[one] = {element_key(el): el for el in one}
+        # Appending to `one` can remove the element from `other` (lxml), iterate over a copy
+        for el in list(other):
+            key = element_key(el)
+            match = mapping.get(key)
+            if match is None:
+                # Element not found in the mapping
+                mapping[key] = el
+                one.append(el)
+            elif len(el) == 0:
                 # Not nested
-                try:
-                    mapping[(el.tag, hashabledict(el.attrib))].text = el.text
-                except KeyError:
-                    # Element not found in the mapping
-                    mapping[(el.tag, hashabledict(el.attrib))] = el
-                    one.append(el)
+                match.text = el.text
             else:
-                # Nested
-                try:
-                    # Recursively process the element, and update it in the same way
-                    self.combine_element(mapping[(el.tag, hashabledict(el.attrib))], el)
-                except KeyError:
-                    # Element not found in the mapping
-                    mapping[(el.tag, hashabledict(el.attrib))] = el
-                    one.append(el)
+                # Nested, recursively process the element, and update it in the same way
+                self.combine_element(match, el)
+
+
+class StreamingXMLCombiner(XMLCombiner):
+    """
+    Combines files the same way as XMLCombiner, without loading all of them in memory.
+    Files are read with iterparse: each termEntry is spooled to a temporary database and freed,
+    only the rest of the document is combined in memory. termEntry elements sharing a key are
+    then combined and written one group at a time.
+    """
+
+    marker_tag = "tbx-merge-termentries"
+
+    def __init__(self, filenames):
+        if len(filenames) == 0:
+            raise FileNotFoundError("Invalid path, or path contains no valid files.")
+        self.filenames = filenames
+        self.mappings = {}
+
+    def spool_file(self, filename, file_index, spool):
+        """
+        Reads a file, replacing its termEntry elements by a single marker element, and returns its root.
+        Each termEntry is stored in the slot it gets merged into, following XMLCombiner.combine_element.
+        """
+        parents = []
+        position = 0
+        slots = self.slots
+        pending = None
+        entries = []
+        for event, el in iterparse_xml(filename, events=("start", "end")):
+            if event == "start":
+                parents.append(el)
+                continue
+            parents.pop()
+            is_entry = el.tag == "termEntry" and parents and parents[-1].tag == "body"
+            if pending is not None and (is_entry or el is pending[1]):
+                # The tail of a termEntry is only complete once the parser is past the next termEntry, or the end of body
+                entry, body = pending
+                key = element_key(entry)
+                if file_index == 0 or key not in slots:
+                    # Every termEntry of the first file is kept, later ones with the same key are merged into the last of them
+                    slots[key] = self.slot_count
+                    self.slot_count += 1
+                tail = entry.tail
+                entry.tail = None
+                entries.append(
+                    (slots[key], file_index, position, et.tostring(entry, encoding="unicode"), tail)
+                )
+                position += 1
+                if body.find(self.marker_tag) is None:
+                    # Put the marker in place of the first termEntry, the parser may still append to body
+                    body.insert(list(body).index(entry), et.Element(self.marker_tag))
+                body.remove(entry)
+                pending = None
+                if len(entries) >= 1000:
+                    spool.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)", entries)
+                    entries = []
+            if is_entry:
+                pending = (el, parents[-1])
+
+        spool.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?)", entries)
+        return el
+
+    def write(self, output_path, transform=None):
+        """Writes the combined file to output_path, calling transform() on each combined termEntry first."""
+        with tempfile.TemporaryDirectory() as temp_dir, closing(
+            sqlite3.connect(os.path.join(temp_dir, "spool.sqlite"))
+        ) as spool:
+            spool.execute(
+                "CREATE TABLE entries (slot INTEGER, file INTEGER, position INTEGER, data TEXT, tail TEXT)"
+            )
+            self.slots = {}
+            self.slot_count = 0
+            try:
+                with profiler.phase("spool", Path(self.filenames[0]).name):
+                    skeleton = self.spool_file(self.filenames[0], 0, spool)
+                for file_index, filename in enumerate(self.filenames[1:], 1):
+                    with profiler.phase("spool", Path(filename).name):
+                        self.combine_element(skeleton, self.spool_file(filename, file_index, spool))
+            except SyntaxError:
+                print("Invalid tbx file, possibly due to incorrect locale code. Check your locales file to ensure all locale codes are valid.")
+                raise
+            spool.execute("CREATE INDEX entries_slot ON entries (slot, file, position)")
+
+            document = io.BytesIO()
+            et.ElementTree(skeleton).write(document, encoding="UTF-8", xml_declaration=True)
+            marker = et.tostring(et.Element(self.marker_tag))
+            head, _, end = document.getvalue().partition(marker)
+
+            with profiler.phase("write"), open(output_path, "wb") as f:
+                f.write(head)
+                rows = spool.execute(
+                    "SELECT slot, data, tail FROM entries ORDER BY slot, file, position"
+                )
+                for _, group in groupby(rows, key=lambda row: row[0]):
+                    _, data, tail = next(group)
+                    merged = et.fromstring(data)
+                    for _, data, _ in group:
+                        el = et.fromstring(data)
+                        if len(el) == 0:
+                            merged.text = el.text
+                        else:
+                            self.combine_element(merged, el)
+                    if transform:
+                        transform(merged)
+                    merged.tail = tail
+                    f.write(et.tostring(merged, encoding="unicode").encode("utf-8"))
+                    # Combined elements are written, don't keep their mappings around
+                    self.mappings.clear()
+                f.write(end)
+
+
+class IncrementalXMLCombiner(XMLCombiner):
+    """
+    Combines files the same way as XMLCombiner, reusing the result of the previous run.
+    The merged glossary is kept in state_folder with the hash of each locale's export: langSet
+    elements of locales whose export changed or was removed are dropped from it, and only the
+    changed exports are combined into it again.
+    """
+
+    def __init__(self, filenames, state_folder):
+        if len(filenames) == 0:
+            raise FileNotFoundError("Invalid path, or path contains no valid files.")
+        self.filenames = filenames
+        self.mappings = {}
+        self.glossary_path = os.path.join(state_folder, merged_glossary_filename)
+        self.state_path = os.path.join(state_folder, merge_state_filename)
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state.get("version") != merge_state_version or not os.path.isfile(self.glossary_path):
+            return None
+        return state
+
+    def read_exports(self, filenames):
+        """Parses exports, returns their roots and the termEntry IDs and languages each one contains."""
+        self.roots = []
+        contents = {}
+        for f in filenames:
+            try:
+                with profiler.phase("parse XML", Path(f).name):
+                    root = parse_xml(f).getroot()
+            except SyntaxError:
+                print("Invalid tbx file, possibly due to incorrect locale code. Check your locales file to ensure all locale codes are valid.")
+                raise
+            self.roots.append(root)
+            contents[export_locale(f)] = {
+                "entries": [termEntry.get("id") for termEntry in root.iter("termEntry")],
+                "languages": sorted(
+                    {langSet.get(xml_lang) for langSet in root.iter("langSet")} - {"en-US"}
+                ),
+            }
+        return contents
+
+    def combine(self):
+        with profiler.phase("hash exports"):
+            hashes = {export_locale(f): hash_file(f) for f in self.filenames}
+        state = self.read_state()
+        unchanged = [
+            locale
+            for locale, file_hash in hashes.items()
+            if state and state["locales"].get(locale, {}).get("sha256") == file_hash
+        ]
+
+        if not unchanged:
+            # Nothing to reuse, combine all exports
+            contents = self.read_exports(self.filenames)
+            tree = super().combine()
+            changed = list(hashes)
+        else:
+            contents = {locale: state["locales"][locale] for locale in unchanged}
+            changed = [locale for locale in hashes if locale not in contents]
+            stale = [locale for locale in state["locales"] if locale not in contents]
+            with profiler.phase("parse XML", merged_glossary_filename):
+                tree = parse_xml(self.glossary_path)
+            root = tree.getroot()
+            if stale:
+                stale_languages = {
+                    language for locale in stale for language in state["locales"][locale]["languages"]
+                } - {language for locale in unchanged for language in contents[locale]["languages"]}
+                for termEntry in root.iter("termEntry"):
+                    for langSet in list(termEntry):
+                        if langSet.tag == "langSet" and langSet.get(xml_lang) in stale_languages:
+                            termEntry.remove(langSet)
+            if changed:
+                changed_files = [f for f in self.filenames if export_locale(f) in changed]
+                contents.update(self.read_exports(changed_files))
+                for f, other in zip(changed_files, self.roots):
+                    with profiler.phase("combine", Path(f).name):
+                        self.combine_element(root, other)
+            if stale:
+                # Drop terms that are no longer in any export
+                entries = {id for locale in contents for id in contents[locale]["entries"]}
+                for body in root.iter("body"):
+                    for termEntry in list(body):
+                        if termEntry.tag == "termEntry" and termEntry.get("id") not in entries:
+                            body.remove(termEntry)
+
+        with profiler.phase("write"):
+            tree.write(self.glossary_path, encoding="UTF-8", xml_declaration=True)
+        for locale in contents:
+            contents[locale]["sha256"] = hashes[locale]
+        with open(self.state_path, "w") as f:
+            json.dump(
+                {"version": merge_state_version, "locales": contents},
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        print(f"Combined {len(changed)} changed of {len(hashes)} locales.")
+        return tree
+
+
+def export_locale(path):
+    """Returns the locale code of a Pontoon export file."""
+    return Path(path).name[: -len("_pontoon.tbx")]
+
+
+def find_child(el, tag, attribute=None, value=None):
+    """Returns the first child of el with the given tag (and attribute value), or None."""
+    for child in el:
+        if child.tag == tag and (attribute is None or child.get(attribute) == value):
+            return child
+    return None
+
+
+def find_path(el, *steps):
+    """Follows (tag, attribute, value) steps from el through first matching children, returns the text of the last one."""
+    for step in steps:
+        if el is None:
+            return None
+        el = find_child(el, *step)
+    return None if el is None else el.text
+
+
+en_us_langset = ("langSet", xml_lang, "en-US")
+definition_descrip = ("descrip", "type", "definition")
+
+
+def smartling_term_key(termEntry):
+    """Returns the (term, definition) key of a termEntry from a Smartling export."""
+    term = find_path(termEntry, en_us_langset, ("tig",), ("term",))
+    definition = find_path(termEntry, definition_descrip)
+    return term, definition
+
+
+def pontoon_term_key(termEntry):
+    """Returns the (term, definition) key of a termEntry from a Pontoon export."""
+    langset = find_child(termEntry, *en_us_langset)
+    term = find_path(langset, ("ntig",), ("termGrp",), ("term",))
+    definition = find_path(langset, ("descripGrp",), definition_descrip)
+    return term, definition
 
 
 def extract_smartling_id_term(f):
     """ "Creates a dictionary with (term, definition) as key, and the Smartling UID as value."""
-    root = et.parse(f).getroot()
     smartling_map = {}
-    for termEntry in root.iter("termEntry"):
-        term = termEntry.find(
-            "./langSet[@xml:lang='en-US']/tig/term",
-            nsmap,
-        ).text
-        try:
-            definition = termEntry.find(
-                "./descrip[@type='definition']",
-                nsmap,
-            ).text
-        except AttributeError:
-            definition = None
-        id = termEntry.attrib["id"]
-        smartling_map[(term, definition)] = id
+    # Each termEntry is read once as the file is parsed, and cleared once its key and ID are known
+    for _, termEntry in iterparse_xml(f, events=("end",)):
+        if termEntry.tag != "termEntry":
+            continue
+        key = smartling_term_key(termEntry)
+        if key[0] is not None and "id" in termEntry.attrib:
+            smartling_map[key] = termEntry.attrib["id"]
+        termEntry.clear()
+
+    return smartling_map
+
 
+def hash_file(path):
+    """Returns the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_smartling_map(path, cache_folder):
+    """
+    Returns the (term, definition) to Smartling UID map of a Smartling export.
+    The map is cached in cache_folder with the export's hash, and only extracted again if the export changed.
+    """
+    cache_path = os.path.join(cache_folder, smartling_cache_filename)
+    file_hash = hash_file(path)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache.get("sha256") == file_hash:
+            return {(term, definition): id for term, definition, id in cache["terms"]}
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        pass
+
+    with profiler.phase("extract Smartling IDs"):
+        smartling_map = extract_smartling_id_term(path)
+    with open(cache_path, "w") as f:
+        json.dump(
+            {
+                "sha256": file_hash,
+                "terms": [[term, definition, id] for (term, definition), id in smartling_map.items()],
+            },
+            f,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
     return smartling_map
 
 
-def replace_pontoon_ids(etree, smartling_map):
-    """Replaces Pontoon IDs with Smartling IDs if the term and definition match exactly a term in Smartling glossary file."""
+def replace_pontoon_ids(etree, smartling_map, report=None):
+    """
+    Replaces Pontoon IDs with Smartling IDs if the term and definition match exactly a term in Smartling glossary file.
+    Counts of matched and unmatched terms, and of removed Pontoon IDs, are added to report.
+    """
+    if report is None:
+        report = Counter()
     root = etree.getroot()
-    pontoon_term_map = {}
     for termEntry in root.iter("termEntry"):
-        term = termEntry.find(
-            "./langSet[@xml:lang='en-US']/ntig/termGrp/term",
-            nsmap,
-        ).text
-        try:
-            definition = termEntry.find(
-                "./langSet[@xml:lang='en-US']/descripGrp/descrip[@type='definition']",
-                nsmap,
-            ).text
-        except AttributeError:
-            definition = None
-        pontoon_term_map[(term, definition)] = termEntry
-
-    for key in pontoon_term_map:
-        if key in smartling_map:
-            pontoon_term_map[key].attrib["id"] = smartling_map[key]
+        id = smartling_map.get(pontoon_term_key(termEntry))
+        if id is not None:
+            termEntry.attrib["id"] = id
+            report["matched"] += 1
         else:
-            pontoon_term_map[key].attrib.pop("id", None)
+            report["unmatched"] += 1
+            if termEntry.attrib.pop("id", None) is not None:
+                report["cleared"] += 1
+    return report
+
+
+def print_id_report(report):
+    print(
+        f"Smartling IDs: {report['matched']} matched, {report['unmatched']} unmatched, "
+        f"{report['cleared']} Pontoon IDs cleared."
+    )
 
 
 def remove_all_ids(etree):
@@ -111,7 +445,43 @@ def remove_all_ids(etree):
         termEntry.attrib.pop("id", None)
 
 
-def export_tbx(locale_list):
+def download_tbx(session, url, file_path, cache_entry):
+    """
+    Streams a TBX export to file_path, revalidating the existing file with its ETag/Last-Modified if possible.
+    Returns the validators to cache for the next download.
+    """
+    headers = {}
+    if cache_entry and os.path.isfile(file_path):
+        if cache_entry.get("etag"):
+            headers["If-None-Match"] = cache_entry["etag"]
+        if cache_entry.get("last_modified"):
+            headers["If-Modified-Since"] = cache_entry["last_modified"]
+
+    with profiler.phase("download", Path(file_path).name), session.get(
+        url, headers=headers, stream=True, timeout=60
+    ) as response:
+        if response.status_code == 304:
+            return cache_entry
+        response.raise_for_status()
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+
+def exports_folder():
+    """Returns the folder Pontoon exports and caches are stored in, creating it if needed."""
     root_path = os.path.abspath(
         os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
     )
@@ -119,19 +489,50 @@ def export_tbx(locale_list):
     locale_path = os.path.join(root_path, "pontoon_exports")
     if not os.path.isdir(locale_path):
         os.mkdir(locale_path)
-
-    for locale in locale_list:
-        try:
-            response = requests.get(
-                f"https://pontoon.mozilla.org/terminology/{locale}.v2.tbx"
+    return locale_path
+
+
+def export_tbx(locale_list, jobs=8, base_url=pontoon_url):
+    locale_path = exports_folder()
+
+    cache_path = os.path.join(locale_path, export_cache_filename)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        cache = {}
+
+    # One pooled session shared by all workers, so connections to Pontoon are reused
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=jobs)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    export_files = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            locale: executor.submit(
+                download_tbx,
+                session,
+                f"{base_url}/terminology/{locale}.v2.tbx",
+                os.path.join(locale_path, f"{locale}_pontoon.tbx"),
+                cache.get(locale),
             )
+            for locale in locale_list
+        }
+        for locale, future in futures.items():
+            try:
+                cache[locale] = future.result()
+                export_files.append(Path(locale_path, f"{locale}_pontoon.tbx"))
+            except Exception as e:
+                cache.pop(locale, None)
+                print(f"Failed to export {locale}: {e}")
+    session.close()
 
-            with open(os.path.join(locale_path, f"{locale}_pontoon.tbx"), "wb") as f:
-                f.write(response.content)
-        except Exception as e:
-            print(e)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
 
-    return list(Path(locale_path).glob("*.tbx"))
+    return export_files
 
 
 def main():
@@ -154,35 +555,94 @@ def main():
         dest="smartling_export",
         help="Path to glossary tbx file exported from Smartling. Required when using --id-format smartling",
     )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=8,
+        dest="jobs",
+        help="Number of concurrent downloads from Pontoon (default: 8)",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        dest="streaming",
+        help="Merge one termEntry at a time and write the output incrementally, instead of loading all glossaries in memory.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        dest="incremental",
+        help="Reuse the glossary merged by the previous run, and only combine locales whose export changed since.",
+    )
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    if args.incremental and args.streaming:
+        parser.error("--incremental can't be combined with --streaming.")
     if args.ids == "smartling" and not args.smartling_export:
         parser.error(
             "Path to Smartling glossary tbx file not defined (--smartling argument required)."
         )
 
+    profiler.start(args)
+
     with open(args.locale_list) as f:
-        locale_list = [locale.strip() for locale in f]
+        locale_list = [locale.strip() for locale in f if locale.strip()]
+
+    with profiler.phase("export"):
+        merge_files = export_tbx(locale_list, args.jobs)
+
+    if args.streaming:
+        # IDs are updated on each combined termEntry as it is written
+        if args.ids == "pontoon":
+            StreamingXMLCombiner(merge_files).write("pontoon_glossary_multilingual.tbx")
+
+        if args.ids == "smartling":
+            with profiler.phase("load Smartling map"):
+                smartling_map = load_smartling_map(args.smartling_export, exports_folder())
+            report = Counter()
+            StreamingXMLCombiner(merge_files).write(
+                "smartling_merge_glossary.tbx",
+                lambda termEntry: replace_pontoon_ids(et.ElementTree(termEntry), smartling_map, report),
+            )
+            print_id_report(report)
 
-    merge_files = export_tbx(locale_list)
-    merged_tree = XMLCombiner(merge_files).combine()
+        if args.ids == "new":
+            StreamingXMLCombiner(merge_files).write(
+                "smartling_new_glossary.tbx",
+                lambda termEntry: remove_all_ids(et.ElementTree(termEntry)),
+            )
+        return
+
+    if args.incremental:
+        merged_tree = IncrementalXMLCombiner(merge_files, exports_folder()).combine()
+    else:
+        merged_tree = XMLCombiner(merge_files).combine()
 
     if args.ids == "pontoon":
-        merged_tree.write(
-            "pontoon_glossary_multilingual.tbx", encoding="UTF-8", xml_declaration=True
-        )
+        with profiler.phase("write"):
+            merged_tree.write(
+                "pontoon_glossary_multilingual.tbx", encoding="UTF-8", xml_declaration=True
+            )
 
     if args.ids == "smartling":
-        smartling_map = extract_smartling_id_term(args.smartling_export)
-        replace_pontoon_ids(merged_tree, smartling_map)
-        merged_tree.write(
-            "smartling_merge_glossary.tbx", encoding="UTF-8", xml_declaration=True
-        )
+        with profiler.phase("load Smartling map"):
+            smartling_map = load_smartling_map(args.smartling_export, exports_folder())
+        with profiler.phase("replace IDs"):
+            report = replace_pontoon_ids(merged_tree, smartling_map)
+        with profiler.phase("write"):
+            merged_tree.write(
+                "smartling_merge_glossary.tbx", encoding="UTF-8", xml_declaration=True
+            )
+        print_id_report(report)
 
     if args.ids == "new":
         remove_all_ids(merged_tree)
-        merged_tree.write(
-            "smartling_new_glossary.tbx", encoding="UTF-8", xml_declaration=True
-        )
+        with profiler.phase("write"):
+            merged_tree.write(
+                "smartling_new_glossary.tbx", encoding="UTF-8", xml_declaration=True
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+"""
+Detects strings whose value changed between two versions of a locale folder without getting a
+new ID. Localizers are only notified of new IDs, so changing the text of an existing ID leaves
+outdated translations in place.
+
+Only files that differ between the two folders are parsed, in parallel.
+
+Requires: compare_locales
+
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from compare_locales.parser import getParser
+
+
+def value_hashes(filename, contents):
+    """
+    Parses the content of a localization file. Returns a dictionary with the hash of the value
+    (and attributes) of each string ID, None if the file format isn't supported.
+    """
+    try:
+        parser = getParser(filename)
+    except UserWarning:
+        return None
+    parser.readContents(contents)
+
+    hashes = {}
+    for entity in parser.walk(only_localizable=True):
+        value = [entity.raw_val] + [
+            [attribute.key, attribute.val] for attribute in getattr(entity, "attributes", [])
+        ]
+        hashes[f"{entity}"] = hashlib.sha1(json.dumps(value).encode("utf-8")).hexdigest()
+    return hashes
+
+
+def changed_ids(base_hashes, head_hashes):
+    """Returns the IDs present in both versions with a different value, in head order."""
+    return [
+        string_id
+        for string_id, value_hash in head_hashes.items()
+        if string_id in base_hashes and base_hashes[string_id] != value_hash
+    ]
+
+
+def compare_contents(filename, base_contents, head_contents):
+    base_hashes = value_hashes(filename, base_contents)
+    if base_hashes is None:
+        return []
+    return changed_ids(base_hashes, value_hashes(filename, head_contents))
+
+
+def find_changed_ids(files, jobs):
+    """
+    Compares (filename, base content, head content) tuples in a process pool.
+    Returns a dictionary with the IDs that changed value in each file.
+    """
+    # Identical files can't have changed strings, skip parsing them
+    files = [f for f in files if f[1] != f[2]]
+    if jobs == 1 or len(files) < 2:
+        results = [compare_contents(*f) for f in files]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(
+                executor.map(
+                    compare_contents,
+                    *zip(*files),
+                    chunksize=max(1, len(files) // (jobs * 4)),
+                )
+            )
+    return {f[0]: ids for f, ids in zip(files, results) if ids}
+
+
+def read_file_pairs(base_dir, head_dir, locale_dir):
+    """
+    Returns (relative path, base content, head content) for files in locale_dir that exist in both
+    folders.
+    """
+    files = []
+    for root, _, filenames in os.walk(os.path.join(head_dir, locale_dir)):
+        for filename in filenames:
+            head_path = os.path.join(root, filename)
+            rel_path = os.path.relpath(head_path, head_dir)
+            base_path = os.path.join(base_dir, rel_path)
+            if not os.path.isfile(base_path):
+                # New file, all IDs are new
+                continue
+            with open(base_path, "rb") as f:
+                base_contents = f.read()
+            with open(head_path, "rb") as f:
+                head_contents = f.read()
+            files.append((rel_path, base_contents, head_contents))
+    files.sort()
+    return files
+
+
+def print_changed_ids(results):
+    if not results:
+        print("No changed strings without new IDs.")
+        return
+    print("Strings changed without a new ID:")
+    for filename, ids in results.items():
+        print(f"{filename}")
+        for string_id in ids:
+            print(f"  {string_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--base_dir",
+        required=True,
+        help="Path to the folder with the base version of the files",
+    )
+    parser.add_argument(
+        "--head_dir",
+        required=True,
+        help="Path to the folder with the new version of the files",
+    )
+    parser.add_argument(
+        "--locale_dir",
+        default="",
+        help="Path of the reference locale folder, relative to --base_dir and --head_dir (e.g. locale/en)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes used to parse files (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        dest="json_output",
+        help="Print changed IDs per file as JSON",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    files = read_file_pairs(args.base_dir, args.head_dir, args.locale_dir)
+    results = find_changed_ids(files, args.jobs)
+
+    if args.json_output:
+        print(json.dumps(results, indent=2))
+    else:
+        print_changed_ids(results)
+    if results:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
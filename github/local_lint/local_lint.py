@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+"""
+Lints the FTL files changed between two commits with moz-fluent-lint.
+
+Files are read straight from git objects, with a single `git cat-file --batch` process for all
+base and head files, instead of being copied to temporary folders. Only changed files are
+linted, in parallel, using the rules in linter_config.yml. Strings of the reference locale that
+changed value without a new ID are then reported (see detect_unchanged_ids.py).
+
+Requires: moz-fluent-linter, compare_locales
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import yaml
+from fluent.syntax import parse
+from fluent_linter.linter import Linter, get_offsets_and_lines
+
+from detect_unchanged_ids import find_changed_ids, print_changed_ids
+
+default_config_path = Path(__file__).resolve().parent / "linter_config.yml"
+
+
+class StructuredLinter(Linter):
+    """Linter collecting errors as dictionaries instead of formatted text."""
+
+    def add_error(self, node, message_id, rule, msg):
+        (col, line) = self.span_to_line_and_col(node.span)
+        self.results.append(
+            {
+                "file": self.path,
+                "message_id": message_id,
+                "line": line,
+                "column": col,
+                "rule": rule,
+                "message": msg,
+            }
+        )
+
+
+def git(repo_path, *args):
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=repo_path, capture_output=True, check=True
+        ).stdout
+    except subprocess.CalledProcessError as e:
+        sys.exit(f"git {' '.join(args)} failed: {e.stderr.decode().strip()}")
+
+
+def changed_files(repo_path, base, head):
+    """Returns the paths of files changed between base and head, except deleted files."""
+    output = git(repo_path, "diff", "--name-only", "-z", "--no-renames", "--diff-filter=d", base, head)
+    return [path.decode() for path in output.split(b"\0") if path]
+
+
+def read_blobs(repo_path, objects):
+    """
+    Reads objects ("<commit>:<path>") with a single git cat-file process.
+    Returns a dictionary with the content of each object, None for missing objects.
+    """
+    if not objects:
+        return {}
+    process = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        cwd=repo_path,
+        input="".join(f"{o}\n" for o in objects).encode(),
+        capture_output=True,
+        check=True,
+    )
+    output = process.stdout
+    blobs = {}
+    pos = 0
+    # Each object is "<sha> <type> <size>\n<content>\n", or "<name> missing\n"
+    for o in objects:
+        end = output.index(b"\n", pos)
+        header = output[pos:end].split()
+        pos = end + 1
+        if header[-1] == b"missing" or header[1] != b"blob":
+            if header[-1] != b"missing":
+                pos += int(header[2]) + 1
+            blobs[o] = None
+            continue
+        size = int(header[2])
+        blobs[o] = output[pos : pos + size]
+        pos += size + 1
+    return blobs
+
+
+def read_config(path):
+    with open(path) as f:
+        return list(yaml.safe_load_all(f))[0] or {}
+
+
+def lint_file(config, path, contents):
+    """Returns the errors found in the content of a single FTL file."""
+    results = []
+    # Ensure that the file has an empty line at the end
+    if contents and not contents.endswith("\n"):
+        results.append(
+            {
+                "file": path,
+                "message_id": None,
+                "line": contents.count("\n") + 1,
+                "column": None,
+                "rule": "MI02",
+                "message": "Missing empty line at the end of the file",
+            }
+        )
+    linter = StructuredLinter(path, "", config, contents, get_offsets_and_lines(contents))
+    linter.visit(parse(contents))
+    return results + linter.results
+
+
+def lint_files(files, config, jobs):
+    """Lints files (path to content), returns all errors in file order."""
+    paths = sorted(files)
+    contents = [files[path] for path in paths]
+    lint = partial(lint_file, config)
+    if jobs == 1 or len(paths) < 2:
+        results = map(lint, paths, contents)
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        with executor:
+            results = list(
+                executor.map(
+                    lint, paths, contents, chunksize=max(1, len(paths) // (jobs * 4))
+                )
+            )
+    return [error for file_errors in results for error in file_errors]
+
+
+def print_results(results):
+    for r in results:
+        print("")
+        print(f"File path: {r['file']}")
+        if r["rule"] != "MI02":
+            print(f"Message ID: {r['message_id'] or '-'}")
+            print(f"Position: line {r['line']} column {r['column']}")
+        print(f"Error ({r['rule']}): {r['message']}")
+    if not results:
+        print("No errors found.")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repo",
+        default=".",
+        dest="repo_path",
+        help="Path to the repository to check (default: current folder)",
+    )
+    parser.add_argument(
+        "--head",
+        "-p",
+        required=True,
+        dest="head",
+        help="Pull request SHA (or any commit) to lint",
+    )
+    parser.add_argument(
+        "--base",
+        default="HEAD",
+        dest="base",
+        help="Commit to compare against (default: HEAD)",
+    )
+    parser.add_argument(
+        "--config",
+        default=str(default_config_path),
+        dest="config_path",
+        help="Path to linter configuration (default: linter_config.yml next to this script)",
+    )
+    parser.add_argument(
+        "--locale_dir",
+        default="locale/en",
+        help="Path of the reference locale folder in the repository, checked for strings changed without a new ID (default: locale/en)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        dest="jobs",
+        help="Number of processes used to lint files (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        dest="json_output",
+        help="Print errors as JSON",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    paths = changed_files(args.repo_path, args.base, args.head)
+    locale_prefix = args.locale_dir.strip("/") + "/" if args.locale_dir.strip("/") else ""
+    locale_paths = [path for path in paths if path.startswith(locale_prefix)]
+    head_paths = [path for path in paths if path.endswith(".ftl") or path in locale_paths]
+    blobs = read_blobs(
+        args.repo_path,
+        [f"{args.head}:{path}" for path in head_paths]
+        + [f"{args.base}:{path}" for path in locale_paths],
+    )
+    head_files = {
+        path: blobs[f"{args.head}:{path}"].decode("utf-8")
+        for path in paths
+        if path.endswith(".ftl")
+    }
+    # Files added in head have no base version, all their IDs are new
+    locale_files = [
+        (path, blobs[f"{args.base}:{path}"], blobs[f"{args.head}:{path}"])
+        for path in locale_paths
+        if blobs[f"{args.base}:{path}"] is not None
+    ]
+
+    if not args.json_output:
+        print(f"Linting for brand names, files to analyze: {len(head_files)}.")
+    config = read_config(args.config_path)
+    results = lint_files(head_files, config, args.jobs)
+    if not args.json_output:
+        print_results(results)
+        print("")
+        print("Checking for unchanged ids")
+    changed_ids = find_changed_ids(locale_files, args.jobs)
+
+    if args.json_output:
+        print(
+            json.dumps(
+                {"files": sorted(head_files), "errors": results, "changed_ids": changed_ids},
+                indent=2,
+            )
+        )
+    else:
+        print_changed_ids(changed_ids)
+    if results or changed_ids:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
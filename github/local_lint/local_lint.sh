@@ -4,7 +4,7 @@
 #Import environment variables: 
 #repo_path: path to repo you're checking, e.g. ~/fxa
 #config_path: path to linter_config.yml
-#detect_unchanged_ids: path to detect_unchanged_ids script
+#detect_unchanged_ids: path to detect_unchanged_ids script (detect_unchanged_ids.py in this folder)
 source ./env.txt
 
 helpFunction()
@@ -0,0 +1,317 @@
+#! /usr/bin/env python
+"""
+Compares gettext templates (.pot) extracted from the main branch and from a pull request.
+
+Strings are compared by msgctxt and msgid, so only added, removed and changed strings are
+reported, not reordered strings or updated references. Extracted templates are cached by commit
+SHA and extraction options, so checking several pull requests against the same main commit
+extracts main only once.
+
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+cache_path = Path(__file__).resolve().parent / "pot_cache"
+escapes = {"n": "\n", "t": "\t", "r": "\r", '"': '"', "\\": "\\", "a": "\a", "b": "\b", "f": "\f", "v": "\v"}
+
+
+def git(repo_path, *args):
+    """Runs a git command in the repo, returns its output."""
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=repo_path, capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except subprocess.CalledProcessError as e:
+        sys.exit(f"git {' '.join(args)} failed: {e.stderr.strip()}")
+
+
+def run_command(command, cwd):
+    """Runs a shell command, its output goes to stderr so stdout only has the diff."""
+    print(f"Running: {command}", file=sys.stderr, flush=True)
+    if subprocess.run(command, shell=True, cwd=cwd, stdout=sys.stderr).returncode != 0:
+        sys.exit(f"Command failed: {command}")
+
+
+def unquote(line):
+    """Returns the content of a quoted PO string."""
+    return re.sub(r"\\(.)", lambda m: escapes.get(m.group(1), m.group(1)), line.strip()[1:-1])
+
+
+def parse_pot(path):
+    """
+    Parses a PO/POT file. Returns a dictionary with (msgctxt, msgid) as key, and the plural form,
+    flags and extracted comments of each string as value. References and the header are ignored.
+    """
+    entries = {}
+    entry = {}
+    field = None
+
+    def add_entry():
+        if entry.get("msgid"):
+            key = (entry.get("msgctxt"), entry["msgid"])
+            entries[key] = {
+                "msgid_plural": entry.get("msgid_plural"),
+                "flags": sorted(entry.get("flags", [])),
+                "comments": "\n".join(entry.get("comments", [])),
+            }
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                # Blank lines separate entries
+                add_entry()
+                entry, field = {}, None
+            elif line.startswith("#~"):
+                # Obsolete string
+                continue
+            elif line.startswith("#,"):
+                entry.setdefault("flags", []).extend(
+                    flag.strip() for flag in line[2:].split(",") if flag.strip()
+                )
+            elif line.startswith("#."):
+                entry.setdefault("comments", []).append(line[2:].strip())
+            elif line.startswith("#"):
+                continue
+            elif line.startswith('"'):
+                if field:
+                    entry[field] += unquote(line)
+            else:
+                keyword, _, value = line.partition(" ")
+                if keyword in ("msgctxt", "msgid") and "msgid" in entry:
+                    # A new entry without a blank line before it
+                    add_entry()
+                    entry = {}
+                field = keyword
+                entry[field] = unquote(value)
+    add_entry()
+
+    return entries
+
+
+def diff_pot(base, head):
+    """Returns the added, removed and changed strings between two parsed templates."""
+    added = [key for key in head if key not in base]
+    removed = [key for key in base if key not in head]
+    changed = []
+    for key, value in head.items():
+        if key in base and base[key] != value:
+            changes = {
+                field: [base[key][field], value[field]]
+                for field in value
+                if base[key][field] != value[field]
+            }
+            changed.append((key, changes))
+    return added, removed, changed
+
+
+def cache_key(sha, args):
+    """Returns the name of the cache folder for templates extracted at commit sha with the current options."""
+    options = [args.work_dir, args.pot_dir, args.extract_command]
+    digest = hashlib.sha256(json.dumps(options).encode("utf-8")).hexdigest()
+    return f"{sha}-{digest[:12]}"
+
+
+def extract_templates(repo_path, sha, args, state):
+    """
+    Returns the folder with the templates extracted at commit sha, running the extraction only
+    if they're not cached yet.
+    """
+    cached_path = cache_path / cache_key(sha, args)
+    if args.use_cache and all((cached_path / name).is_file() for name in args.pot_files):
+        print(f"Using cached templates for {sha[:12]}", file=sys.stderr)
+        return cached_path
+
+    git(repo_path, "checkout", "--quiet", "--detach", sha)
+    work_path = repo_path / args.work_dir
+    if not work_path.is_dir():
+        sys.exit(f"Folder {args.work_dir} doesn't exist in the repository at {sha[:12]}, check --work-dir.")
+    if not state.get("setup_done"):
+        if args.setup_command:
+            run_command(args.setup_command, repo_path)
+        state["setup_done"] = True
+
+    pot_path = work_path / args.pot_dir
+    # Delete local copies of .pot files, if they exist
+    for name in args.pot_files:
+        if (pot_path / name).exists():
+            (pot_path / name).unlink()
+    run_command(args.extract_command, work_path)
+
+    missing = [name for name in args.pot_files if not (pot_path / name).is_file()]
+    if missing:
+        sys.exit(f"Extraction at {sha[:12]} didn't create: {', '.join(missing)}")
+
+    # Copy to a temporary folder first, so an interrupted copy is never used as cache
+    cache_path.mkdir(parents=True, exist_ok=True)
+    temp_path = Path(tempfile.mkdtemp(dir=cache_path))
+    for name in args.pot_files:
+        shutil.copy2(pot_path / name, temp_path / name)
+    if cached_path.exists():
+        shutil.rmtree(cached_path)
+    os.replace(temp_path, cached_path)
+
+    return cached_path
+
+
+def format_key(key):
+    msgctxt, msgid = key
+    return f"[{msgctxt}] {msgid}" if msgctxt is not None else msgid
+
+
+def print_diff(name, added, removed, changed):
+    print(f"Diff of {name}")
+    for label, keys in (("Added", added), ("Removed", removed)):
+        if keys:
+            print(f"  {label} ({len(keys)}):")
+            for key in keys:
+                print(f"    {format_key(key)!r}")
+    if changed:
+        print(f"  Changed ({len(changed)}):")
+        for key, changes in changed:
+            print(f"    {format_key(key)!r}")
+            for field, (old, new) in changes.items():
+                print(f"      {field}: {old!r} -> {new!r}")
+    if not (added or removed or changed):
+        print("  No changes")
+    print("")
+
+
+def diff_json(added, removed, changed):
+    as_dict = lambda key: {"msgctxt": key[0], "msgid": key[1]}
+    return {
+        "added": [as_dict(key) for key in added],
+        "removed": [as_dict(key) for key in removed],
+        "changed": [dict(as_dict(key), changes=changes) for key, changes in changed],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repo",
+        default=".",
+        dest="repo_path",
+        help="Path to the repository to check, e.g. ~/fxa (default: current folder)",
+    )
+    head = parser.add_mutually_exclusive_group(required=True)
+    head.add_argument(
+        "--pull",
+        dest="pull_id",
+        help="GitHub pull request ID (e.g. #12345 at the end of the title), fetched from --remote",
+    )
+    head.add_argument(
+        "--head",
+        dest="head_ref",
+        help="Local branch or commit to compare, instead of a pull request",
+    )
+    parser.add_argument(
+        "--base",
+        default="main",
+        dest="base_branch",
+        help="Branch to compare against (default: main)",
+    )
+    parser.add_argument(
+        "--remote",
+        default="upstream",
+        help="Remote to fetch the base branch and pull requests from (default: upstream)",
+    )
+    parser.add_argument(
+        "--no-fetch",
+        action="store_false",
+        dest="fetch",
+        help="Use the local base branch without fetching the remote first",
+    )
+    parser.add_argument(
+        "--work-dir",
+        default="packages/fxa-content-server",
+        dest="work_dir",
+        help="Folder (relative to the repository) where strings are extracted (default: packages/fxa-content-server)",
+    )
+    parser.add_argument(
+        "--pot-dir",
+        default="locale/templates/LC_MESSAGES",
+        dest="pot_dir",
+        help="Folder (relative to --work-dir) with the extracted templates (default: locale/templates/LC_MESSAGES)",
+    )
+    parser.add_argument(
+        "--files",
+        nargs="+",
+        default=["client.pot", "server.pot"],
+        dest="pot_files",
+        help="Templates to compare (default: client.pot server.pot)",
+    )
+    parser.add_argument(
+        "--setup-command",
+        default="yarn workspaces focus fxa-content-server",
+        dest="setup_command",
+        help="Command run in the repository before the first extraction, empty to skip",
+    )
+    parser.add_argument(
+        "--extract-command",
+        default="npx grunt l10n-extract",
+        dest="extract_command",
+        help="Command run in --work-dir to extract the templates (default: npx grunt l10n-extract)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="use_cache",
+        help=f"Extract templates even if they're cached in {cache_path}",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        dest="json_output",
+        help="Print the differences as JSON",
+    )
+    args = parser.parse_args()
+
+    repo_path = Path(args.repo_path).expanduser().resolve()
+    if git(repo_path, "status", "--porcelain", "--untracked-files=no"):
+        sys.exit("The repository has uncommitted changes, commit or stash them first.")
+
+    base_ref = args.base_branch
+    if args.fetch:
+        git(repo_path, "fetch", "--quiet", args.remote, args.base_branch)
+        base_ref = f"{args.remote}/{args.base_branch}"
+    if args.pull_id:
+        git(repo_path, "fetch", "--quiet", args.remote, f"pull/{args.pull_id.lstrip('#')}/head")
+        head_ref = "FETCH_HEAD"
+    else:
+        head_ref = args.head_ref
+    base_sha = git(repo_path, "rev-parse", "--verify", f"{base_ref}^{{commit}}")
+    head_sha = git(repo_path, "rev-parse", "--verify", f"{head_ref}^{{commit}}")
+
+    # Restore the current branch (or commit) once done
+    original_ref = git(repo_path, "rev-parse", "--abbrev-ref", "HEAD")
+    if original_ref == "HEAD":
+        original_ref = git(repo_path, "rev-parse", "HEAD")
+    state = {}
+    try:
+        base_path = extract_templates(repo_path, base_sha, args, state)
+        head_path = extract_templates(repo_path, head_sha, args, state)
+    finally:
+        git(repo_path, "checkout", "--quiet", original_ref)
+
+    results = {}
+    for name in args.pot_files:
+        results[name] = diff_pot(parse_pot(base_path / name), parse_pot(head_path / name))
+
+    if args.json_output:
+        print(json.dumps({name: diff_json(*diff) for name, diff in results.items()}, indent=2))
+    else:
+        for name, diff in results.items():
+            print_diff(name, *diff)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,307 @@
 #! /usr/bin/env python
 
 import argparse
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
 import tinify
 
 
 tinify.key = ""
+manifest_filename = ".optimize_png_manifest.json"
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+# Number of channels for each PNG color type
+png_channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+png_critical_chunks = {b"IHDR", b"PLTE", b"IDAT", b"IEND"}
+# Ancillary chunks dropped by the local engine: text and metadata, which don't change how the
+# image is displayed. Color management (gAMA, cHRM, sRGB, iCCP, sBIT...) and other chunks are kept.
+png_dropped_chunks = {b"tEXt", b"zTXt", b"iTXt", b"tIME", b"eXIf"}
+zlib_strategies = [zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED]
+
+
+class RateLimiter(object):
+    """Spaces out calls to wait() across threads, so that at most `rate` calls return per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+def is_temporary(error):
+    """Rate limits, server and connection errors are worth retrying, other errors aren't."""
+    if isinstance(error, tinify.AccountError):
+        return error.status == 429
+    return isinstance(error, (tinify.ServerError, tinify.ConnectionError))
+
+
+def compress_remote(data, limiter, retries):
+    """Compresses PNG data with Tinify, retrying with exponential backoff on temporary errors."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return tinify.from_buffer(data).to_buffer()
+        except tinify.Error as e:
+            if attempt == retries or not is_temporary(e):
+                raise
+            time.sleep(2**attempt)
+
+
+def read_chunks(data):
+    """Returns the (type, data) chunks of a PNG file."""
+    if not data.startswith(png_signature):
+        raise ValueError("Not a PNG file")
+    chunks = []
+    pos = len(png_signature)
+    while pos < len(data):
+        (length,) = struct.unpack(">I", data[pos : pos + 4])
+        chunk_type = data[pos + 4 : pos + 8]
+        chunks.append((chunk_type, data[pos + 8 : pos + 8 + length]))
+        pos += 12 + length
+        if chunk_type == b"IEND":
+            break
+    return chunks
+
+
+def make_chunk(chunk_type, body):
+    return (
+        struct.pack(">I", len(body))
+        + chunk_type
+        + body
+        + struct.pack(">I", zlib.crc32(chunk_type + body))
+    )
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    return b if pb <= pc else c
+
+
+def unfilter_rows(data, height, row_bytes, bpp):
+    """Reverts PNG filters on decompressed image data, returns the raw rows."""
+    rows = []
+    previous = bytearray(row_bytes)
+    pos = 0
+    for _ in range(height):
+        filter_type = data[pos]
+        row = bytearray(data[pos + 1 : pos + 1 + row_bytes])
+        pos += 1 + row_bytes
+        if filter_type == 1:
+            for i in range(bpp, row_bytes):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        elif filter_type == 2:
+            row = bytearray((x + b) & 0xFF for x, b in zip(row, previous))
+        elif filter_type == 3:
+            for i in range(row_bytes):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + previous[i]) >> 1)) & 0xFF
+        elif filter_type == 4:
+            for i in range(row_bytes):
+                if i >= bpp:
+                    row[i] = (row[i] + paeth(row[i - bpp], previous[i], previous[i - bpp])) & 0xFF
+                else:
+                    row[i] = (row[i] + previous[i]) & 0xFF
+        elif filter_type != 0:
+            raise ValueError(f"Invalid PNG filter type {filter_type}")
+        rows.append(row)
+        previous = row
+    return rows
+
+
+def filter_row(row, previous, bpp):
+    """Returns the row filtered with each of the five PNG filter types."""
+    left = bytes(bpp) + row[:-bpp]
+    upper_left = bytes(bpp) + previous[:-bpp]
+    return [
+        bytes(row),
+        bytes((x - a) & 0xFF for x, a in zip(row, left)),
+        bytes((x - b) & 0xFF for x, b in zip(row, previous)),
+        bytes((x - ((a + b) >> 1)) & 0xFF for x, a, b in zip(row, left, previous)),
+        bytes(
+            (x - paeth(a, b, c)) & 0xFF
+            for x, a, b, c in zip(row, left, previous, upper_left)
+        ),
+    ]
+
+
+def filtered_streams(rows, row_bytes, bpp):
+    """
+    Returns the image data filtered with each filter type for all rows, and with the filter
+    type that minimizes the sum of absolute differences picked for each row.
+    """
+    streams = [[] for _ in range(6)]
+    previous = bytes(row_bytes)
+    for row in rows:
+        candidates = filter_row(bytes(row), previous, bpp)
+        for filter_type, filtered in enumerate(candidates):
+            streams[filter_type].append(bytes([filter_type]) + filtered)
+        best = min(
+            range(5), key=lambda t: sum(x if x < 128 else 256 - x for x in candidates[t])
+        )
+        streams[5].append(bytes([best]) + candidates[best])
+        previous = bytes(row)
+    return [b"".join(stream) for stream in streams]
+
+
+def deflate(data, strategy):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9, strategy)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_local(data):
+    """
+    Recompresses PNG data losslessly: tries all filter strategies with the strongest zlib settings,
+    and drops text and metadata chunks. Returns the data unchanged if it can't be handled.
+    """
+    chunks = read_chunks(data)
+    chunk_types = {chunk_type for chunk_type, _ in chunks}
+    # Leave animated PNGs, and files with unknown critical chunks, as they are
+    if b"acTL" in chunk_types or any(
+        chunk_type[:1].isupper() and chunk_type not in png_critical_chunks
+        for chunk_type in chunk_types
+    ):
+        return data
+
+    ihdr = chunks[0][1]
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+    bits_per_pixel = png_channels[color_type] * bit_depth
+    bpp = max(1, bits_per_pixel // 8)
+    row_bytes = (width * bits_per_pixel + 7) // 8
+    image_data = zlib.decompress(b"".join(body for chunk_type, body in chunks if chunk_type == b"IDAT"))
+
+    if interlace:
+        # Interlaced rows are stored in passes of different widths, only recompress them
+        streams = [image_data]
+    else:
+        rows = unfilter_rows(image_data, height, row_bytes, bpp)
+        streams = filtered_streams(rows, row_bytes, bpp)
+    idat = min(
+        (deflate(stream, strategy) for stream in streams for strategy in zlib_strategies),
+        key=len,
+    )
+
+    # Kept chunks stay on the same side of the image data, as their order matters
+    first_idat = next(index for index, (chunk_type, _) in enumerate(chunks) if chunk_type == b"IDAT")
+    kept_chunks = [
+        [
+            make_chunk(chunk_type, body)
+            for chunk_type, body in part
+            if chunk_type not in png_dropped_chunks | {b"IDAT", b"IEND"}
+        ]
+        for part in (chunks[:first_idat], chunks[first_idat:])
+    ]
+    return b"".join(
+        [png_signature]
+        + kept_chunks[0]
+        + [make_chunk(b"IDAT", idat)]
+        + kept_chunks[1]
+        + [make_chunk(b"IEND", b"")]
+    )
+
+
+def write_file(path, data):
+    """Replaces the content of a file, without leaving a partially written file behind."""
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if path.exists():
+            os.chmod(temp_path, path.stat().st_mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def optimize_image(image, compress):
+    """
+    Optimizes an image in place with compress() if the result is smaller.
+    Returns its size before and after, and the hash of its final content.
+    """
+    data = image.read_bytes()
+    optimized = compress(data)
+    if len(optimized) >= len(data):
+        return len(data), len(data), hash_data(data)
+    write_file(image, optimized)
+    return len(data), len(optimized), hash_data(optimized)
+
+
+def hash_data(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_manifest(path):
+    """Reads the manifest of optimized images, mapping relative paths to their hash, size and mtime."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_manifest(manifest, path):
+    write_file(path, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def manifest_entry(image, digest, engine):
+    stat = image.stat()
+    return {"sha256": digest, "size": stat.st_size, "mtime": stat.st_mtime_ns, "engine": engine}
+
+
+def is_optimized(image, entry, engine):
+    """
+    Checks if an image is unchanged since it was optimized with engine. Files with the same size and
+    mtime as recorded are assumed to be unchanged, the content is only hashed if the mtime changed.
+    """
+    if entry is None or entry.get("engine", "tinify") != engine:
+        return False
+    stat = image.stat()
+    if stat.st_size != entry["size"]:
+        return False
+    if stat.st_mtime_ns == entry["mtime"]:
+        return True
+    if hash_data(image.read_bytes()) != entry["sha256"]:
+        return False
+    # Same content, e.g. after a checkout, record the new mtime to avoid hashing next time
+    entry["mtime"] = stat.st_mtime_ns
+    return True
+
+
+def print_summary(sizes, failures, skipped, elapsed):
+    before = sum(size for size, _ in sizes)
+    after = sum(size for _, size in sizes)
+    saved = before - after
+    print("")
+    print(f"Optimized images: {len(sizes)}")
+    print(f"Failed images: {len(failures)}")
+    print(f"Skipped images (already optimized): {skipped}")
+    print(f"Bytes saved: {saved} of {before} ({saved / before:.1%})" if before else "Bytes saved: 0")
+    if elapsed:
+        print(
+            f"Throughput: {len(sizes) / elapsed:.2f} images/s, "
+            f"{before / elapsed / 1024:.1f} KiB/s in {elapsed:.1f}s"
+        )
 
 
 def main():
@@ -18,25 +314,104 @@ def main():
     )
     parser.add_argument(
         "--key",
-        help="API Key",
-        required=True,
+        help="API Key, required with the tinify engine",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["tinify", "local"],
+        default="tinify",
+        help="Optimize images with the Tinify API (lossy), or locally by recompressing them (lossless, slower, smaller gains)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of images optimized at the same time (default: 4 with tinify, number of CPUs with local)",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="Maximum number of images sent per second, 0 for no limit (default: 0)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=5,
+        help="Number of retries on rate limit, server or connection errors, with exponential backoff (default: 5)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=f"Optimize all images, including the ones recorded as already optimized in {manifest_filename}",
+    )
+    parser.add_argument(
+        "--endpoint",
+        default=tinify.Client.API_ENDPOINT,
+        help=f"Base URL of the Tinify API (default: {tinify.Client.API_ENDPOINT})",
     )
     args = parser.parse_args()
+    if args.engine == "tinify" and not args.key:
+        parser.error("--key is required with the tinify engine.")
+    if args.jobs is None:
+        args.jobs = 4 if args.engine == "tinify" else os.cpu_count() or 1
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    if args.rate < 0 or args.retries < 0:
+        parser.error("--rate and --retries can't be negative.")
 
-    tinify.key = args.key
+    tinify.key = args.key or ""
+    tinify.Client.API_ENDPOINT = args.endpoint.rstrip("/")
 
     src_path = Path(args.path)
     file_paths = [p for p in src_path.rglob("**/*.png")]
 
+    # Only images that are new or changed since they were last optimized are sent
+    manifest_path = src_path / manifest_filename
+    previous_manifest = {} if args.force else read_manifest(manifest_path)
+    manifest = {}
+    pending = []
     for image in file_paths:
-        # Optimize image
-        try:
-            print(f"Optimizing image: {image}")
-            source = tinify.from_file(image)
-            source.to_file(image)
-        except Exception as e:
-            print(e)
-            print(f"Error optimizing image: {image}")
+        key = image.relative_to(src_path).as_posix()
+        entry = previous_manifest.get(key)
+        if is_optimized(image, entry, args.engine):
+            manifest[key] = entry
+        else:
+            pending.append(image)
+    skipped = len(file_paths) - len(pending)
+
+    if args.engine == "local":
+        # Recompression is CPU bound, run it in separate processes
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        compress = compress_local
+    else:
+        executor = ThreadPoolExecutor(max_workers=args.jobs)
+        compress = partial(compress_remote, limiter=RateLimiter(args.rate), retries=args.retries)
+    sizes = []
+    failures = []
+    start = time.perf_counter()
+    try:
+        with executor:
+            futures = {
+                executor.submit(optimize_image, image, compress): image
+                for image in pending
+            }
+            for future in as_completed(futures):
+                image = futures[future]
+                # Optimize image
+                try:
+                    before, after, digest = future.result()
+                    sizes.append((before, after))
+                    manifest[image.relative_to(src_path).as_posix()] = manifest_entry(image, digest, args.engine)
+                    print(f"Optimized image: {image} ({before} -> {after} bytes)")
+                except Exception as e:
+                    failures.append(image)
+                    print(e)
+                    print(f"Error optimizing image: {image}")
+    finally:
+        # Keep track of the images optimized so far, even if the run is interrupted
+        write_manifest(manifest, manifest_path)
+
+    print_summary(sizes, failures, skipped, time.perf_counter() - start)
 
 
 if __name__ == "__main__":